@@ -1,21 +1,52 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, render_template, request, send_from_directory, send_file, url_for, abort, Response, jsonify
 from flask_socketio import SocketIO, emit
+from werkzeug.security import safe_join
 from database import db
+from archive import MessageArchive
+from retention import archive_old_messages
+from sessions import SessionTracker
+from presence import PresenceBatcher, AdmissionController
+from receipts import WatermarkStore
+from transport import socketio_options, pack_payload
+from state import RecentWindow, save_snapshot, load_snapshot
+from workload import WorkloadRecorder
+from fanout import BroadcastBatcher
+from backpressure import OutboundGuard
+from storage import UploadStore, QuotaExceeded
+from assets import load_manifest, negotiate_encoding, choose_encoding
+from config import (ARCHIVE_CONFIG, SESSION_CONFIG, PRESENCE_CONFIG, ASSET_CONFIG, SYNC_CONFIG,
+                    RECEIPT_CONFIG, TRANSPORT_PROFILES, TRANSPORT_PROFILE, LAUNCHER_CONFIG, SNAPSHOT_CONFIG,
+                    WORKLOAD_CONFIG, FANOUT_CONFIG, BACKPRESSURE_CONFIG,
+                    STORAGE_CONFIG)
 import datetime
 import re
 import os
-import uuid
+import gzip
+import hashlib
+import mimetypes
 from werkzeug.utils import secure_filename
 import base64
 import threading
-import psutil
+import signal
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'socketbot_secret_key'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'mp3', 'wav'}
 
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    message_queue=LAUNCHER_CONFIG['message_queue'],
+    **socketio_options(TRANSPORT_PROFILE)
+)
+compression_threshold = TRANSPORT_PROFILES[TRANSPORT_PROFILE]['payload_compression_threshold']
+
+archive = MessageArchive(
+    ARCHIVE_CONFIG['directory'],
+    ARCHIVE_CONFIG['block_size'],
+    ARCHIVE_CONFIG['segment_max_messages']
+)
 
 def show_threads_and_sockets():
     print("\n========== 🧵 THREADS ==========")
@@ -23,6 +54,8 @@ def show_threads_and_sockets():
     for thread in threading.enumerate():
         print(f"➡️ Name: {thread.name} | Daemon: {thread.daemon} | Alive: {thread.is_alive()}")
 
+    # psutil is only needed by this debug route, keep it off the import path
+    import psutil
     print("\n========== 🔌 SOCKETS ==========")
     p = psutil.Process(os.getpid())
     connections = p.connections(kind='inet')
@@ -37,35 +70,140 @@ def check_system():
     show_threads_and_sockets()
     return "System info printed in terminal."
 
+@app.route("/metrics/outbound")
+def outbound_metrics():
+    return jsonify(outbound.stats())
+
+@app.route("/metrics/fanout")
+def fanout_metrics():
+    return jsonify(fanout.stats())
+
+@app.route("/metrics/uploads")
+def upload_metrics():
+    return jsonify(uploads.stats())
+
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 active_users = {}
 typing_users = {}
 conference_users = {}  # Track users in video conference
+session_tracker = SessionTracker()
+presence = PresenceBatcher()
+admission = AdmissionController(PRESENCE_CONFIG['admission_rate'], PRESENCE_CONFIG['admission_burst'])
+user_ids = {}  # username -> user id, saves a lookup on reconnect
+receipts = WatermarkStore()
+recent_window = RecentWindow(SNAPSHOT_CONFIG['window_size'])
+fanout = BroadcastBatcher(socketio, FANOUT_CONFIG['rate_threshold'], FANOUT_CONFIG['max_delay'],
+                          FANOUT_CONFIG['max_batch'])
+outbound = OutboundGuard(
+    socketio,
+    BACKPRESSURE_CONFIG['high_water'],
+    BACKPRESSURE_CONFIG['low_water'],
+    BACKPRESSURE_CONFIG['evict_after'],
+    BACKPRESSURE_CONFIG['max_depth']
+)
+def referenced_files():
+    """{file_path: user_id} of every message with an upload, None if the database is unreachable"""
+    # Read the database before the archive: retention archives messages
+    # before deleting them, so a message moving between the two is
+    # always seen in one of them
+    referenced = db.get_file_messages()
+    if referenced is not None:
+        referenced.update(archive.file_owners())
+    return referenced
+
+uploads = UploadStore(
+    db,
+    referenced_files,
+    app.config['UPLOAD_FOLDER'],
+    STORAGE_CONFIG['trash'],
+    STORAGE_CONFIG['user_quota'],
+    STORAGE_CONFIG['global_quota'],
+    STORAGE_CONFIG['shard_levels'],
+    STORAGE_CONFIG['orphan_min_age'],
+    STORAGE_CONFIG['trash_retention']
+)
+recorder = WorkloadRecorder(WORKLOAD_CONFIG['capture_path']) if WORKLOAD_CONFIG['capture_path'] else None
+
+def capture(event, data=None, **fields):
+    if recorder:
+        recorder.record(request.sid, event, data, **fields)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+asset_manifest = load_manifest(os.path.join(app.root_path, ASSET_CONFIG['output']))
+index_cache = {}
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': asset_url}
+
+def asset_url(filename):
+    # Falls back to the plain static file when assets have not been built
+    if filename in asset_manifest:
+        return url_for('built_asset', filename=asset_manifest[filename])
+    return url_for('static', filename=filename)
+
+@app.route('/assets/<path:filename>')
+def built_asset(filename):
+    path = safe_join(os.path.join(app.root_path, ASSET_CONFIG['output']), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    file_path, encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), path)
+    response = send_file(file_path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_CONFIG['max_age']}, immutable"
+    return response
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    if app.debug:
+        return render_template('index.html')
+    # The page has no per-request content, so render and compress it once
+    if not index_cache:
+        body = render_template('index.html').encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()
+        try:
+            import brotli
+            index_cache['br'] = (brotli.compress(body), digest + '-br')
+        except ImportError:
+            pass
+        index_cache['gzip'] = (gzip.compress(body), digest + '-gz')
+        index_cache[None] = (body, digest)
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), [e for e in index_cache if e])
+    body, etag = index_cache[encoding]
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request)
 
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 @socketio.on('connect')
 def handle_connect():
+    # Entry points that only import the app (wsgi.py) start the jobs here
+    start_background_jobs()
     print(f"Client connected: {request.sid}")
     emit('connection_response', {'status': 'connected', 'socket_id': request.sid})
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    capture('disconnect')
     if request.sid in active_users:
         user = active_users[request.sid]
         username = user['username']
         user_id = user['user_id']
-        db.set_user_status(user_id, 'offline')
+        presence.mark(user_id, username, 'offline')
+        session_tracker.discard(request.sid)
+        db.close_user_session(request.sid)
         del active_users[request.sid]
         if request.sid in conference_users:
             del conference_users[request.sid]
@@ -75,15 +213,11 @@ def handle_disconnect():
                 'action': 'ended',
                 'initiator_sid': request.sid
             }, broadcast=True)
-        emit('user_status', {
-            'username': username,
-            'status': 'offline',
-            'active_users': get_active_usernames()
-        }, broadcast=True)
         print(f"User {username} disconnected")
 
 @socketio.on('register')
 def handle_registration(data):
+    capture('register', data)
     username = data.get('username', '').strip()
     if not username:
         emit('registration_response', {'status': 'error', 'message': 'Username is required'})
@@ -96,50 +230,63 @@ def handle_registration(data):
             emit('registration_response', {'status': 'error', 'message': 'This username is already in use'})
             return
     try:
-        user_id = db.save_user(username)
+        last_message_id = int(data.get('last_message_id') or 0)
+    except (TypeError, ValueError):
+        last_message_id = -1
+    if last_message_id < 0:
+        emit('registration_response', {'status': 'error', 'message': 'Invalid last message ID'})
+        return
+    retry_after = admission.try_acquire()
+    if retry_after:
+        emit('registration_response', {'status': 'retry', 'retry_after': int(retry_after * 1000)})
+        return
+    try:
+        user_id = user_ids.get(username) or db.save_user(username, set_online=False)
         if user_id:
-            db.save_user_session(
-                user_id,
-                request.sid,
-                request.remote_addr,
-                request.headers.get('User-Agent', '')
-            )
+            user_ids[username] = user_id
+            session_args = (user_id, request.sid, request.remote_addr, request.headers.get('User-Agent', ''))
+            if LAUNCHER_CONFIG['message_queue']:
+                # The name may be taken on another worker; its session row is the claim
+                if db.claim_user_session(*session_args, SESSION_CONFIG['lease_seconds']) is False:
+                    emit('registration_response', {'status': 'error', 'message': 'This username is already in use'})
+                    return
+            else:
+                db.save_user_session(*session_args)
+            presence.mark(user_id, username, 'online')
             active_users[request.sid] = {
                 'username': username,
                 'user_id': user_id
             }
-            recent_messages = db.get_recent_messages(50)
-            formatted_messages = []
-            for msg in recent_messages:
-                statuses = db.get_message_status(msg['id'])
-                formatted_statuses = {s['user_id']: s['status'] for s in statuses}
-                if msg['username'] != username:
-                    db.update_message_status(msg['id'], user_id, 'seen')
-                    formatted_statuses[user_id] = 'seen'
-                    emit('message_status', {
-                        'message_id': msg['id'],
-                        'user_id': user_id,
-                        'status': 'seen'
-                    }, broadcast=True)
-                formatted_messages.append({
-                    'id': msg['id'],
-                    'username': msg['username'],
-                    'message': msg['message'],
-                    'message_type': msg['message_type'],
-                    'file_path': msg['file_path'],
-                    'timestamp': format_timestamp(msg['created_at']),
-                    'statuses': formatted_statuses
+            missed_count = None
+            if last_message_id:
+                missed_count = db.count_messages_after(last_message_id)
+                if missed_count is not None and (archive.last_id() > last_message_id or missed_count > SYNC_CONFIG['snapshot_threshold']):
+                    # Too far behind to catch up message by message
+                    missed_count = None
+            if missed_count is None:
+                recent_messages = get_recent_window(SYNC_CONFIG['snapshot_size'])
+                missing = SYNC_CONFIG['snapshot_size'] - len(recent_messages)
+                if missing > 0:
+                    # Retention may have moved older messages, or all of them, to the archive
+                    before_id = recent_messages[0]['id'] if recent_messages else archive.last_id() + 1
+                    recent_messages = archive.get_messages_before(before_id, missing) + recent_messages
+                emit('registration_response', pack_payload({
+                    'status': 'success',
+                    'username': username,
+                    'sync': 'snapshot',
+                    'recent_messages': deliver_messages(recent_messages, user_id),
+                    'active_users': get_active_usernames()
+                }, compression_threshold))
+            else:
+                emit('registration_response', {
+                    'status': 'success',
+                    'username': username,
+                    'sync': 'delta',
+                    'missed_count': missed_count,
+                    'recent_messages': [],
+                    'active_users': get_active_usernames()
                 })
-            emit('registration_response', {
-                'status': 'success',
-                'username': username,
-                'recent_messages': formatted_messages
-            })
-            emit('user_status', {
-                'username': username,
-                'status': 'online',
-                'active_users': get_active_usernames()
-            }, broadcast=True)
+                send_missed_messages(last_message_id, user_id)
             emit('conference_users', {
                 'users': list(conference_users.values())
             })
@@ -167,18 +314,15 @@ def handle_message(data):
     saved_message = db.save_message(user_id, message, message_type, file_path)
     
     if saved_message:
-        db.update_user_session(request.sid)
+        # Captured with the id it was given so replays can remap receipts to it
+        capture('chat_message', data, message_id=saved_message['id'])
+        recent_window.extend([saved_message])
+        session_tracker.touch(request.sid)
         timestamp = format_timestamp(saved_message['created_at'])
         message_id = saved_message['id']
-        statuses = {}
-        other_users = [u for sid, u in active_users.items() if u['user_id'] != user_id]
-        if other_users:
-            for sid, u in active_users.items():
-                if u['user_id'] != user_id:
-                    db.update_message_status(message_id, u['user_id'], 'delivered')
-                    statuses[u['user_id']] = 'delivered'
+        statuses = mark_delivered(message_id, user_id)
         
-        emit('new_message', {
+        fanout.publish({
             'id': message_id,
             'username': username,
             'message': message,
@@ -186,7 +330,7 @@ def handle_message(data):
             'file_path': file_path,
             'timestamp': timestamp,
             'statuses': statuses
-        }, broadcast=True)
+        })
         if request.sid in typing_users:
             del typing_users[request.sid]
             update_typing_status()
@@ -204,26 +348,29 @@ def handle_file_upload(data):
         return
     
     try:
-        header, encoded = file_data.split(',', 1)
+        if isinstance(file_data, (bytes, bytearray)):
+            # Sent as a binary attachment, no base64 overhead
+            content = bytes(file_data)
+        else:
+            header, encoded = file_data.split(',', 1)
+            content = base64.b64decode(encoded)
         extension = 'png' if file_type == 'image' else 'webm' if file_type == 'voice' else 'mp3'
-        filename = f"{uuid.uuid4()}.{extension}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(base64.b64decode(encoded))
+        try:
+            filename = uploads.save(user['user_id'], content, extension)
+        except QuotaExceeded as e:
+            emit('file_response', {'status': 'error', 'message': str(e)})
+            return
         
         message = ''
         saved_message = db.save_message(user['user_id'], message, file_type, filename)
         
         if saved_message:
+            capture('upload_file', data, message_id=saved_message['id'])
+            recent_window.extend([saved_message])
             timestamp = format_timestamp(saved_message['created_at'])
             message_id = saved_message['id']
-            statuses = {}
-            for sid, u in active_users.items():
-                if u['user_id'] != user['user_id']:
-                    db.update_message_status(message_id, u['user_id'], 'delivered')
-                    statuses[u['user_id']] = 'delivered'
-            emit('new_message', {
+            statuses = mark_delivered(message_id, user['user_id'])
+            fanout.publish({
                 'id': message_id,
                 'username': user['username'],
                 'message': message,
@@ -231,9 +378,10 @@ def handle_file_upload(data):
                 'file_path': filename,
                 'timestamp': timestamp,
                 'statuses': statuses
-            }, broadcast=True)
+            })
             emit('file_response', {'status': 'success', 'message': 'File uploaded'})
         else:
+            uploads.discard(user['user_id'], filename)
             emit('file_response', {'status': 'error', 'message': 'Error saving file'})
     except Exception as e:
         print(f"File upload error: {e}")
@@ -241,6 +389,7 @@ def handle_file_upload(data):
 
 @socketio.on('typing')
 def handle_typing(data):
+    capture('typing', data)
     if request.sid not in active_users:
         return
     is_typing = data.get('is_typing', False)
@@ -259,21 +408,56 @@ def handle_typing(data):
 
 @socketio.on('get_users')
 def handle_get_users():
+    capture('get_users')
     emit('active_users', {'users': get_active_usernames()})
 
 @socketio.on('message_seen')
 def handle_message_seen(data):
+    capture('message_seen', data)
     if request.sid not in active_users:
         return
     user = active_users[request.sid]
-    message_id = data.get('message_id')
-    if message_id:
-        db.update_message_status(message_id, user['user_id'], 'seen')
-        emit('message_status', {
+    try:
+        message_id = int(data.get('message_id') or 0)
+    except (TypeError, ValueError):
+        return
+    if message_id <= 0:
+        return
+    if message_id > recent_window.last_id:
+        # Possibly saved by another worker; never let a watermark run ahead of real messages
+        get_recent_window(0)
+        message_id = min(message_id, recent_window.last_id)
+    # Seeing a message only moves the user's watermark forward
+    if message_id and receipts.advance(db, [user['user_id']], 'seen', message_id):
+        outbound.emit_low_priority('message_status', {
             'message_id': message_id,
             'user_id': user['user_id'],
             'status': 'seen'
-        }, broadcast=True)
+        }, key=user['user_id'])
+
+@socketio.on('load_history')
+def handle_load_history(data):
+    capture('load_history', data)
+    if request.sid not in active_users:
+        return
+    try:
+        before_id = int(data.get('before_id') or 0)
+        limit = max(1, min(int(data.get('limit', 50)), 100))
+    except (TypeError, ValueError):
+        return
+    if before_id <= 0:
+        return
+    history = db.get_messages_before(before_id, limit)
+    if len(history) < limit:
+        # Older history has been moved out of the database by the retention job
+        oldest_id = history[0]['id'] if history else before_id
+        history = archive.get_messages_before(oldest_id, limit - len(history)) + history
+    messages = [format_message(msg, receipts.statuses(db, msg['id'], msg['user_id'])) for msg in history]
+    emit('history_response', pack_payload({
+        'before_id': before_id,
+        'messages': messages,
+        'has_more': len(messages) == limit
+    }, compression_threshold))
 
 @socketio.on('join_conference')
 def handle_join_conference():
@@ -318,7 +502,8 @@ def handle_leave_conference():
 @socketio.on('video_offer')
 def handle_video_offer(data):
     target_sid = data.get('target_sid')
-    if target_sid in active_users:
+    # The peer may be on another worker, the message queue routes it there
+    if request.sid in active_users and target_sid:
         emit('video_offer', {
             'from_sid': request.sid,
             'offer': data['offer'],
@@ -328,7 +513,7 @@ def handle_video_offer(data):
 @socketio.on('video_answer')
 def handle_video_answer(data):
     target_sid = data.get('target_sid')
-    if target_sid in active_users:
+    if request.sid in active_users and target_sid:
         emit('video_answer', {
             'from_sid': request.sid,
             'answer': data['answer']
@@ -337,7 +522,7 @@ def handle_video_answer(data):
 @socketio.on('ice_candidate')
 def handle_ice_candidate(data):
     target_sid = data.get('target_sid')
-    if target_sid in active_users:
+    if request.sid in active_users and target_sid:
         emit('ice_candidate', {
             'from_sid': request.sid,
             'candidate': data['candidate']
@@ -349,16 +534,223 @@ def update_typing_status():
         if (now - typing_users[sid]['timestamp']).total_seconds() > 3:
             del typing_users[sid]
     users_typing = [user['username'] for user in typing_users.values()]
-    socketio.emit('typing_status', {'users': users_typing})
+    outbound.emit_low_priority('typing_status', {'users': users_typing}, key='users')
 
 def get_active_usernames():
-    return {user['user_id']: user['username'] for user in active_users.values()}
+    users = {user['user_id']: user['username'] for user in active_users.values()}
+    if LAUNCHER_CONFIG['message_queue']:
+        # Users of the other workers, from the sessions those keep alive
+        users.update(db.get_live_session_users(SESSION_CONFIG['lease_seconds']))
+    return users
 
 def format_timestamp(timestamp):
     if isinstance(timestamp, str):
         return timestamp
     return timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
+def format_message(msg, statuses):
+    return {
+        'id': msg['id'],
+        'username': msg['username'],
+        'message': msg['message'],
+        'message_type': msg['message_type'],
+        'file_path': msg['file_path'],
+        'timestamp': format_timestamp(msg['created_at']),
+        'statuses': statuses
+    }
+
+def mark_delivered(message_id, author_id):
+    """Advance the delivered watermark of every other online user, returns the message statuses"""
+    recipients = {u['user_id'] for u in active_users.values() if u['user_id'] != author_id}
+    receipts.advance(db, recipients, 'delivered', message_id)
+    return receipts.statuses(db, message_id, author_id)
+
+def get_recent_window(limit):
+    """Newest messages from memory, caught up with anything other processes wrote"""
+    if recent_window.loaded:
+        # Another worker's message can commit after a higher id was already
+        # read, so re-read a few ids below the newest one to pick it up
+        overlap = SNAPSHOT_CONFIG['catchup_overlap'] if LAUNCHER_CONFIG['message_queue'] else 0
+        newer = db.get_messages_after(max(recent_window.last_id - overlap, 0), recent_window.size)
+        if len(newer) < recent_window.size:
+            recent_window.extend(newer)
+            return recent_window.latest(limit)
+    recent_window.replace(db.get_recent_messages(recent_window.size))
+    return recent_window.latest(limit)
+
+def deliver_messages(messages, user_id):
+    """Format messages for a user, marking everything up to the newest one as seen"""
+    if messages and receipts.advance(db, [user_id], 'seen', messages[-1]['id']):
+        outbound.emit_low_priority('message_status', {
+            'message_id': messages[-1]['id'],
+            'user_id': user_id,
+            'status': 'seen'
+        }, key=user_id)
+    return [format_message(msg, receipts.statuses(db, msg['id'], msg['user_id'])) for msg in messages]
+
+def send_missed_messages(last_message_id, user_id):
+    after_id = last_message_id
+    while True:
+        page = db.get_messages_after(after_id, SYNC_CONFIG['page_size'])
+        if page:
+            emit('sync_messages', pack_payload({
+                'messages': deliver_messages(page, user_id)
+            }, compression_threshold))
+            after_id = page[-1]['id']
+        if len(page) < SYNC_CONFIG['page_size']:
+            break
+        socketio.sleep(0)
+    emit('sync_complete', {'last_message_id': after_id})
+
+def retention_job():
+    while True:
+        socketio.sleep(ARCHIVE_CONFIG['interval_seconds'])
+        try:
+            archive_old_messages(db, archive, ARCHIVE_CONFIG['max_age_days'], ARCHIVE_CONFIG['batch_size'])
+        except Exception as e:
+            print(f"Retention job error: {e}")
+
+def presence_job():
+    while True:
+        socketio.sleep(PRESENCE_CONFIG['snapshot_interval'])
+        try:
+            joined, left = presence.flush(db)
+            if joined or left:
+                socketio.emit('presence_snapshot', {
+                    'joined': joined,
+                    'left': left,
+                    'active_users': get_active_usernames()
+                })
+        except Exception as e:
+            print(f"Presence job error: {e}")
+
+def receipt_job():
+    while True:
+        socketio.sleep(RECEIPT_CONFIG['flush_interval'])
+        try:
+            receipts.flush(db)
+            if LAUNCHER_CONFIG['message_queue']:
+                # Other workers advance watermarks too
+                receipts.refresh(db)
+        except Exception as e:
+            print(f"Receipt job error: {e}")
+
+def session_job(collect_garbage=True):
+    last_gc = datetime.datetime.now()
+    while True:
+        socketio.sleep(SESSION_CONFIG['flush_interval'])
+        try:
+            session_tracker.flush(db)
+            if LAUNCHER_CONFIG['message_queue'] and active_users:
+                # Renew the lease on every live session so other workers see them
+                db.touch_user_sessions(list(active_users.keys()))
+            if collect_garbage and (datetime.datetime.now() - last_gc).total_seconds() >= SESSION_CONFIG['gc_interval']:
+                db.delete_stale_sessions(SESSION_CONFIG['ttl_seconds'], list(active_users.keys()))
+                last_gc = datetime.datetime.now()
+        except Exception as e:
+            print(f"Session job error: {e}")
+
+def snapshot_path(name):
+    return SNAPSHOT_CONFIG['path'].format(name=name)
+
+def save_state(name='main', clean=False):
+    messages = recent_window.latest(recent_window.size)
+    save_snapshot(snapshot_path(name), {
+        'presence': sorted({u['user_id'] for u in active_users.values()}),
+        'recent': [dict(m, created_at=format_timestamp(m['created_at'])) for m in messages],
+        'window_loaded': recent_window.loaded,
+        'user_ids': user_ids
+    }, clean)
+
+def flush_pending():
+    """Write batched presence, receipt and session updates before a clean shutdown.
+
+    Returns False while offline marks are still unwritten: a snapshot only
+    lists users still online, so it must not be marked clean then.
+    """
+    presence.flush(db)
+    receipts.flush(db)
+    session_tracker.flush(db)
+    return not presence.pending
+
+def restore_state(name='main'):
+    """Warm the caches from the last snapshot, returns the user ids it saw online after a clean shutdown"""
+    snapshot = load_snapshot(snapshot_path(name))
+    if snapshot is None:
+        return None
+    sections, created_at, clean = snapshot
+    user_ids.update(sections['user_ids'])
+    if sections['window_loaded']:
+        recent_window.replace(sections['recent'])
+    return sections['presence'] if clean else None
+
+def reconcile_presence_job(previous_online):
+    # Give clients of the previous process time to reconnect first
+    socketio.sleep(SNAPSHOT_CONFIG['reconcile_delay'])
+    connected = {u['user_id'] for u in active_users.values()}
+    stale = [user_id for user_id in previous_online if user_id not in connected]
+    if stale:
+        db.set_users_status(stale, 'offline')
+    # Catch the restored window up with messages written while we were down
+    get_recent_window(SYNC_CONFIG['snapshot_size'])
+
+def snapshot_job(name):
+    while True:
+        socketio.sleep(SNAPSHOT_CONFIG['interval'])
+        try:
+            save_state(name)
+        except Exception as e:
+            print(f"Snapshot job error: {e}")
+
+def outbound_job():
+    while True:
+        socketio.sleep(BACKPRESSURE_CONFIG['check_interval'])
+        try:
+            outbound.check()
+        except Exception as e:
+            print(f"Outbound queue check error: {e}")
+
+def upload_scan_job():
+    while True:
+        try:
+            uploads.scan(pause=lambda: socketio.sleep(0))
+        except Exception as e:
+            print(f"Upload scan error: {e}")
+        socketio.sleep(STORAGE_CONFIG['scan_interval'])
+
+background_jobs_started = False
+background_jobs_lock = threading.Lock()
+
+def start_background_jobs(primary=True):
+    """Start the periodic jobs once per process; table-wide maintenance only runs in the primary process"""
+    global background_jobs_started
+    with background_jobs_lock:
+        if background_jobs_started:
+            return
+        background_jobs_started = True
+    socketio.start_background_task(presence_job)
+    socketio.start_background_task(session_job, primary)
+    socketio.start_background_task(receipt_job)
+    socketio.start_background_task(outbound_job)
+    if primary:
+        socketio.start_background_task(retention_job)
+        # Usage counts are shared through the database, one scanner is enough
+        socketio.start_background_task(upload_scan_job)
+
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=8000)
+    db.startup()
+    previous_online = restore_state()
+    if previous_online is None:
+        # No socket survives a restart, so any user still marked online is stale
+        db.reset_online_users()
+    else:
+        socketio.start_background_task(reconcile_presence_job, previous_online)
+    start_background_jobs()
+    socketio.start_background_task(snapshot_job, 'main')
+    # Let SIGTERM stop the server the same way Ctrl+C does, so the final snapshot is written
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        socketio.run(app, host='0.0.0.0', port=8000)
+    finally:
+        save_state(clean=flush_pending())
     show_threads_and_sockets()
\ No newline at end of file
@@ -0,0 +1,205 @@
+import os
+import json
+import zlib
+import struct
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Each index entry: first message id in block, last message id in block,
+# byte offset of the block inside the segment, compressed block length
+INDEX_ENTRY = struct.Struct('<QQQI')
+
+
+class MessageArchive:
+    """Append-only store for cold messages.
+
+    Messages are written in id order to segment files. A segment is a sequence
+    of zlib-compressed blocks of JSON lines; next to it a small sparse index
+    records the id range and byte offset of each block, so a lookup only has
+    to decompress the blocks that overlap the requested range.
+    """
+
+    def __init__(self, directory, block_size=100, segment_max_messages=10000):
+        self.directory = directory
+        self.block_size = block_size
+        self.segment_max_messages = segment_max_messages
+        self.lock = threading.RLock()
+        self.segments = []  # sorted list of segment base ids
+        self.indexes = {}   # base id -> list of index entries
+        self.index_sizes = {}  # base id -> bytes of its index read so far
+        self.repaired = False
+        self.file_owner_cache = {}  # base id -> (blocks read, {file_path: user_id})
+        self.loaded = False
+
+    def _ensure_loaded(self):
+        # Indexes are read on first use so creating the archive costs no I/O.
+        # Another process may be the one appending, so every use also picks up
+        # segments and index entries written since the last look
+        with self.lock:
+            if not self.loaded:
+                self.loaded = True
+                os.makedirs(self.directory, exist_ok=True)
+                self._load_indexes()
+                logger.info(f"Archive opened with {len(self.segments)} segments, last message ID {self.last_id()}")
+            else:
+                self._load_indexes()
+
+    def _segment_path(self, base_id):
+        return os.path.join(self.directory, f"segment-{base_id:012d}.dat")
+
+    def _index_path(self, base_id):
+        return os.path.join(self.directory, f"segment-{base_id:012d}.idx")
+
+    def _load_indexes(self):
+        """Read the index entries added since the last call"""
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('segment-') and name.endswith('.idx')):
+                continue
+            base_id = int(name[len('segment-'):-len('.idx')])
+            size = os.path.getsize(os.path.join(self.directory, name))
+            # A torn trailing entry is a write in progress (or an interrupted one)
+            usable = size - size % INDEX_ENTRY.size
+            known = self.index_sizes.get(base_id, 0)
+            entries = self.indexes.setdefault(base_id, [])
+            if base_id not in self.segments:
+                bisect.insort(self.segments, base_id)
+            if usable <= known:
+                continue
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                f.seek(known)
+                data = f.read(usable - known)
+            for offset in range(0, len(data), INDEX_ENTRY.size):
+                entries.append(INDEX_ENTRY.unpack_from(data, offset))
+            self.index_sizes[base_id] = usable
+
+    def _repair(self):
+        """Drop bytes of an interrupted write before appending after them"""
+        for base_id in self.segments:
+            entries = self.indexes[base_id]
+            index_path = self._index_path(base_id)
+            if os.path.exists(index_path) and os.path.getsize(index_path) > self.index_sizes.get(base_id, 0):
+                with open(index_path, 'r+b') as f:
+                    f.truncate(self.index_sizes.get(base_id, 0))
+                logger.warning(f"Archive index {base_id} truncated to {len(entries)} entries")
+            path = self._segment_path(base_id)
+            end = entries[-1][2] + entries[-1][3] if entries else 0
+            if os.path.exists(path) and os.path.getsize(path) > end:
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+                logger.warning(f"Archive segment {base_id} truncated to {end} bytes")
+
+    def last_id(self):
+        """Return the highest archived message id, or 0 if the archive is empty"""
+        self._ensure_loaded()
+        for base_id in reversed(self.segments):
+            if self.indexes[base_id]:
+                return self.indexes[base_id][-1][1]
+        return 0
+
+    def message_count(self, base_id):
+        return sum(entry[1] - entry[0] + 1 for entry in self.indexes[base_id])
+
+    def append(self, messages):
+        """Append messages (sorted by id, all newer than last_id) to the archive"""
+        if not messages:
+            return 0
+        self._ensure_loaded()
+        with self.lock:
+            if not self.repaired:
+                # Only the appending process may cut off a torn tail, readers
+                # could be looking at a write that is still in progress
+                self.repaired = True
+                self._repair()
+            last_id = self.last_id()
+            messages = [m for m in messages if m['id'] > last_id]
+            for start in range(0, len(messages), self.block_size):
+                self._append_block(messages[start:start + self.block_size])
+            logger.info(f"Archived {len(messages)} messages up to ID {self.last_id()}")
+            return len(messages)
+
+    def _append_block(self, block):
+        if not self.segments or self.message_count(self.segments[-1]) >= self.segment_max_messages:
+            base_id = block[0]['id']
+            self.segments.append(base_id)
+            self.indexes[base_id] = []
+        base_id = self.segments[-1]
+        payload = '\n'.join(json.dumps(m, default=str) for m in block).encode('utf-8')
+        compressed = zlib.compress(payload, 6)
+        segment_path = self._segment_path(base_id)
+        with open(segment_path, 'ab') as f:
+            offset = f.tell()
+            f.write(compressed)
+            f.flush()
+            os.fsync(f.fileno())
+        entry = (block[0]['id'], block[-1]['id'], offset, len(compressed))
+        with open(self._index_path(base_id), 'ab') as f:
+            f.write(INDEX_ENTRY.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        self.indexes[base_id].append(entry)
+        self.index_sizes[base_id] = self.index_sizes.get(base_id, 0) + INDEX_ENTRY.size
+
+    def _read_block(self, base_id, entry):
+        with open(self._segment_path(base_id), 'rb') as f:
+            f.seek(entry[2])
+            data = zlib.decompress(f.read(entry[3]))
+        return [json.loads(line) for line in data.decode('utf-8').split('\n')]
+
+    def get_messages_before(self, before_id, limit=50):
+        """Return up to `limit` archived messages with id < before_id, oldest first"""
+        messages = []
+        self._ensure_loaded()
+        with self.lock:
+            pos = bisect.bisect_left(self.segments, before_id)
+            for base_id in reversed(self.segments[:pos]):
+                entries = self.indexes[base_id]
+                block_pos = bisect.bisect_left([e[0] for e in entries], before_id)
+                for entry in reversed(entries[:block_pos]):
+                    block = [m for m in self._read_block(base_id, entry) if m['id'] < before_id]
+                    messages = block + messages
+                    if len(messages) >= limit:
+                        return messages[-limit:]
+        return messages
+
+    def get_messages_after(self, after_id, limit=50):
+        """Return up to `limit` archived messages with id > after_id, oldest first"""
+        messages = []
+        self._ensure_loaded()
+        with self.lock:
+            for base_id in self.segments:
+                for entry in self.indexes[base_id]:
+                    if entry[1] <= after_id:
+                        continue
+                    messages.extend(m for m in self._read_block(base_id, entry) if m['id'] > after_id)
+                    if len(messages) >= limit:
+                        return messages[:limit]
+        return messages
+
+    def iter_messages(self):
+        """Yield every archived message in id order, one block in memory at a time"""
+        self._ensure_loaded()
+        with self.lock:
+            # Blocks are immutable, so the snapshot can be read without the lock
+            blocks = [(base_id, entry) for base_id in self.segments for entry in self.indexes[base_id]]
+        for base_id, entry in blocks:
+            yield from self._read_block(base_id, entry)
+
+    def file_owners(self):
+        """Return {file_path: user_id} for every archived message with an upload"""
+        owners = {}
+        self._ensure_loaded()
+        with self.lock:
+            for base_id in self.segments:
+                entries = self.indexes[base_id]
+                read, cached = self.file_owner_cache.get(base_id, (0, {}))
+                # Blocks are immutable once written, only new ones are read
+                for entry in entries[read:]:
+                    for m in self._read_block(base_id, entry):
+                        if m.get('file_path'):
+                            cached[m['file_path']] = m['user_id']
+                self.file_owner_cache[base_id] = (len(entries), cached)
+                owners.update(cached)
+        return owners
@@ -0,0 +1,120 @@
+"""Static asset pipeline.
+
+`python assets.py` copies the files listed in ASSET_CONFIG to the output
+directory under content-hashed names (css/styles.3f2a9c1b0d.css) and writes
+gzip and, when the optional `brotli` package is installed, brotli variants
+next to them. A manifest maps each source path to its fingerprinted name so
+templates can reference assets with asset_url() and the app can serve them
+with immutable cache headers.
+"""
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+from config import ASSET_CONFIG
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:10]
+
+
+def compress_variants(path):
+    """Write .gz and (if brotli is available) .br siblings of path"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def build_assets(source=ASSET_CONFIG['source'], output=ASSET_CONFIG['output'], files=ASSET_CONFIG['files']):
+    """Fingerprint and precompress files, returns the manifest"""
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    manifest = {}
+    for name in files:
+        source_path = os.path.join(source, name)
+        stem, ext = os.path.splitext(name)
+        hashed_name = f"{stem}.{fingerprint(source_path)}{ext}"
+        output_path = os.path.join(output, hashed_name)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        shutil.copyfile(source_path, output_path)
+        if ext in ASSET_CONFIG['compress_extensions']:
+            compress_variants(output_path)
+        manifest[name] = hashed_name
+        logger.info(f"Built asset {name} -> {hashed_name}")
+    with open(os.path.join(output, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(output=ASSET_CONFIG['output']):
+    """Return the manifest of the last build, or an empty one if assets were never built"""
+    try:
+        with open(os.path.join(output, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def accepted_encodings(accept_encoding):
+    """Parse an Accept-Encoding header into {encoding: q-value}"""
+    accepted = {}
+    for token in (accept_encoding or '').split(','):
+        name, *params = [part.strip() for part in token.split(';')]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            if param.lower().startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding, available):
+    """Pick the encoding from available (in order of preference) the client
+    rates highest, None for the identity encoding. Encodings with q=0 are
+    refused, '*' covers the ones the header does not name.
+    """
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def negotiate_encoding(accept_encoding, path):
+    """Pick the best precompressed variant of path the client accepts.
+
+    Returns (file path, content encoding or None).
+    """
+    suffixes = {'br': '.br', 'gzip': '.gz'}
+    available = [encoding for encoding, suffix in suffixes.items() if os.path.exists(path + suffix)]
+    encoding = choose_encoding(accept_encoding, available)
+    if encoding is None:
+        return path, None
+    return path + suffixes[encoding], encoding
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    result = build_assets()
+    print(f"Built {len(result)} assets into {ASSET_CONFIG['output']}")
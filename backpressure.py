@@ -0,0 +1,147 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Queue depth histogram buckets: 0, 1, 2-3, 4-7, ... 1024+
+DEPTH_BUCKETS = 12
+
+
+def depth_labels():
+    labels = ['0', '1']
+    for bucket in range(2, DEPTH_BUCKETS - 1):
+        labels.append(f"{1 << (bucket - 1)}-{(1 << bucket) - 1}")
+    labels.append(f"{1 << (DEPTH_BUCKETS - 2)}+")
+    return labels
+
+
+class OutboundGuard:
+    """Per-client outbound queue accounting with slow-consumer handling.
+
+    Every Engine.IO connection buffers outgoing packets in a queue until the
+    client reads them (websocket) or polls for them (long-polling). A client
+    whose queue reaches high_water packets is congested until it drains to
+    low_water: low-priority broadcasts skip it and are held instead, only the
+    latest per collapse key, and are delivered when it recovers. A client
+    congested for evict_after seconds, or with max_depth packets queued, is
+    disconnected and its backlog dropped; it resumes with a delta sync when
+    it reconnects.
+    """
+
+    def __init__(self, socketio, high_water=256, low_water=64, evict_after=30, max_depth=4096, namespace='/'):
+        self.socketio = socketio
+        self.high_water = high_water
+        self.low_water = low_water
+        self.evict_after = evict_after
+        self.max_depth = max_depth
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.congested = {}  # sid -> [congested since, OrderedDict of held events]
+        self.current = [0] * DEPTH_BUCKETS
+        self.samples = [0] * DEPTH_BUCKETS
+        self.dropped = 0
+        self.collapsed = 0
+        self.evicted = 0
+
+    def _depths(self):
+        """Yield (sid, eio sid, queued packets) for every connected client"""
+        server = self.socketio.server
+        # python-socketio drops the namespace entry when its last client leaves
+        if self.namespace not in server.manager.rooms:
+            return
+        for sid, eio_sid in server.manager.get_participants(self.namespace, None):
+            socket = server.eio.sockets.get(eio_sid)
+            if socket is not None:
+                yield sid, eio_sid, socket.queue.qsize()
+
+    def _state(self, sid, depth, now):
+        state = self.congested.get(sid)
+        if state is None and depth >= self.high_water:
+            state = self.congested[sid] = [now, OrderedDict()]
+        return state
+
+    def emit_low_priority(self, event, data, key=None):
+        """Broadcast an event that congested clients can do without.
+
+        Congested clients get only the latest event per (event, key) once
+        they recover; events without a key are dropped for them.
+        """
+        now = time.monotonic()
+        skip = []
+        with self.lock:
+            for sid, _, depth in self._depths():
+                state = self._state(sid, depth, now)
+                if state is None:
+                    continue
+                skip.append(sid)
+                if key is None:
+                    self.dropped += 1
+                    continue
+                held = state[1]
+                if (event, key) in held:
+                    del held[(event, key)]
+                    self.collapsed += 1
+                held[(event, key)] = data
+        self.socketio.emit(event, data, namespace=self.namespace, skip_sid=skip or None)
+
+    def check(self):
+        """Sample queue depths, release recovered clients and evict stuck ones"""
+        now = time.monotonic()
+        current = [0] * DEPTH_BUCKETS
+        evict = []
+        with self.lock:
+            connected = set()
+            for sid, eio_sid, depth in self._depths():
+                connected.add(sid)
+                bucket = min(depth.bit_length(), DEPTH_BUCKETS - 1)
+                current[bucket] += 1
+                self.samples[bucket] += 1
+                state = self._state(sid, depth, now)
+                if state is None:
+                    continue
+                if depth >= self.max_depth or now - state[0] >= self.evict_after:
+                    del self.congested[sid]
+                    evict.append((sid, eio_sid, depth))
+                elif depth <= self.low_water:
+                    del self.congested[sid]
+                    # Sent under the lock so a newer broadcast cannot overtake them
+                    for (event, _), data in state[1].items():
+                        self.socketio.emit(event, data, namespace=self.namespace, to=sid)
+            for sid in set(self.congested) - connected:
+                del self.congested[sid]
+            self.current = current
+        for sid, eio_sid, depth in evict:
+            self._evict(sid, eio_sid, depth)
+
+    def _evict(self, sid, eio_sid, depth):
+        eio = self.socketio.server.eio
+        socket = eio.sockets.get(eio_sid)
+        if socket is None:
+            return
+        # Drop the backlog first so closing does not wait on a client that is not reading
+        queue_empty = eio.get_queue_empty_exception()
+        try:
+            while True:
+                socket.queue.get(block=False)
+                socket.queue.task_done()
+        except queue_empty:
+            pass
+        socket.close(wait=False, abort=True)
+        eio.sockets.pop(eio_sid, None)
+        self.evicted += 1
+        logger.warning(f"Disconnected slow client {sid} with {depth} queued packets")
+
+    def stats(self):
+        labels = depth_labels()
+        with self.lock:
+            return {
+                'clients': sum(self.current),
+                'congested': len(self.congested),
+                'dropped': self.dropped,
+                'collapsed': self.collapsed,
+                'evicted': self.evicted,
+                'queue_depth': dict(zip(labels, self.current)),
+                'queue_depth_samples': dict(zip(labels, self.samples))
+            }
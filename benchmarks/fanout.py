@@ -0,0 +1,70 @@
+"""Cost of broadcasting a burst of chat messages, one packet each vs batched.
+
+A Flask-SocketIO server with --clients in-process test clients receives a
+burst of --messages messages published through BroadcastBatcher, first with
+batching disabled and then with FANOUT_CONFIG. Reported are the packets each
+client received and the server time spent fanning out:
+
+    python benchmarks/fanout.py --clients 200 --messages 500
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_socketio import SocketIO
+from config import FANOUT_CONFIG
+from fanout import BroadcastBatcher
+
+
+def sample_message(message_id):
+    return {
+        'id': message_id,
+        'username': 'bench',
+        'message': f"Burst message number {message_id}",
+        'message_type': 'text',
+        'file_path': None,
+        'timestamp': '2025-05-18 16:21:14',
+        'statuses': {}
+    }
+
+
+def run(clients, messages, rate_threshold):
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+    batcher = BroadcastBatcher(socketio, rate_threshold, FANOUT_CONFIG['max_delay'], FANOUT_CONFIG['max_batch'])
+    test_clients = [socketio.test_client(app) for _ in range(clients)]
+    for client in test_clients:
+        client.get_received()
+    start = time.perf_counter()
+    for message_id in range(1, messages + 1):
+        batcher.publish(sample_message(message_id))
+    batcher.flush()
+    elapsed = time.perf_counter() - start
+    # Let timers from the burst fire before counting
+    time.sleep(FANOUT_CONFIG['max_delay'] * 2)
+    received = test_clients[0].get_received()
+    delivered = sum(len(packet['args'][0]['messages']) if packet['name'] == 'new_messages' else 1
+                    for packet in received)
+    for client in test_clients:
+        client.disconnect()
+    return len(received), delivered, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=500)
+    args = parser.parse_args()
+
+    for label, threshold in (('unbatched', float('inf')), ('batched', FANOUT_CONFIG['rate_threshold'])):
+        packets, delivered, elapsed = run(args.clients, args.messages, threshold)
+        print(f"{label:<10} {packets:>6} packets per client for {delivered} messages, "
+              f"fan-out {elapsed * 1000:.1f} ms ({elapsed / args.messages * 1e6:.0f} us/message)")
+
+
+if __name__ == '__main__':
+    main()
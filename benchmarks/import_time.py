@@ -0,0 +1,84 @@
+"""Measure the cold-start cost of importing the app.
+
+Each sample imports the module in a fresh interpreter, the same work a
+serverless cold start does before it can answer a request. Results are
+compared against the committed baseline, benchmarks/import_time_baseline.json,
+so regressions fail loudly. The baseline is in milliseconds on the machine
+that saved it; re-save it when the reference machine changes:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --save benchmarks/import_time_baseline.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'import_time_baseline.json')
+
+
+def sample(module):
+    """Import module in a fresh interpreter, returns (wall seconds, importtime report)"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def slowest_imports(report, count=10):
+    """Parse `-X importtime` output into the modules with the highest self time"""
+    rows = []
+    for line in report.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|\s+(.*)', line)
+        if match:
+            rows.append((int(match.group(1)), match.group(3).strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--save', help='write the result to this file as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE, help='fail if slower than this saved result')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline')
+    args = parser.parse_args()
+
+    samples = []
+    report = ''
+    for _ in range(args.runs):
+        elapsed, report = sample(args.module)
+        samples.append(elapsed)
+    median_ms = statistics.median(samples) * 1000
+
+    print(f"import {args.module}: median {median_ms:.1f} ms, min {min(samples) * 1000:.1f} ms over {args.runs} runs")
+    print("Slowest imports (self time):")
+    for self_us, name in slowest_imports(report):
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    result = {'module': args.module, 'median_ms': round(median_ms, 1), 'runs': args.runs}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+    if args.baseline and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        limit = baseline['median_ms'] * (1 + args.tolerance)
+        if median_ms > limit:
+            sys.exit(f"Import time regression: {median_ms:.1f} ms > {limit:.1f} ms (baseline {baseline['median_ms']} ms)")
+        print(f"Within budget: {median_ms:.1f} ms <= {limit:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compare per-message status rows with read/delivery watermarks.
+
+Simulates a room where every message is delivered to all other online users
+and then seen by each of them, and counts the rows stored and statements
+written under both models:
+
+    python benchmarks/receipts.py --users 50 --messages 10000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from receipts import WatermarkStore
+
+
+class CountingBackend:
+    """Stands in for Database, recording what WatermarkStore would write"""
+
+    def __init__(self):
+        self.rows = {}
+        self.statements = 0
+
+    def get_watermarks(self, channel):
+        return {}
+
+    def save_watermarks(self, channel, rows):
+        self.statements += 1
+        for user_id, delivered_id, seen_id in rows:
+            self.rows[user_id] = (delivered_id, seen_id)
+        return True
+
+
+def per_message_rows(users, messages):
+    """socket_message_status: one row per message per recipient, each write is SELECT + INSERT/UPDATE"""
+    rows = messages * (users - 1)
+    # delivered (SELECT + INSERT) then seen (SELECT + UPDATE) for every recipient
+    statements = rows * 4
+    return rows, statements
+
+
+def watermarks(users, messages, flush_every):
+    backend = CountingBackend()
+    store = WatermarkStore()
+    start = time.perf_counter()
+    for message_id in range(1, messages + 1):
+        author = random.randrange(users)
+        recipients = [u for u in range(users) if u != author]
+        store.advance(backend, recipients, 'delivered', message_id)
+        for user_id in recipients:
+            store.advance(backend, [user_id], 'seen', message_id)
+        if message_id % flush_every == 0:
+            store.flush(backend)
+    store.flush(backend)
+    return len(backend.rows), backend.statements, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--flush-every', type=int, default=20, help='messages between watermark flushes')
+    args = parser.parse_args()
+
+    old_rows, old_statements = per_message_rows(args.users, args.messages)
+    new_rows, new_statements, elapsed = watermarks(args.users, args.messages, args.flush_every)
+    print(f"{args.users} users, {args.messages} messages")
+    print(f"  per-message status: {old_rows:>10} rows  {old_statements:>10} statements")
+    print(f"  watermarks:         {new_rows:>10} rows  {new_statements:>10} statements  ({elapsed * 1000:.0f} ms in memory)")
+    print(f"  reduction:          {old_rows / max(new_rows, 1):>9.0f}x rows {old_statements / max(new_statements, 1):>9.0f}x statements")
+
+
+if __name__ == '__main__':
+    main()
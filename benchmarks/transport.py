@@ -0,0 +1,184 @@
+"""Connection overhead and bytes per session for each transport profile.
+
+For every profile an in-process Flask-SocketIO server is started with that
+profile's options, behind a local TCP proxy that counts the bytes crossing
+it in each direction. --connections python-socketio clients (pip install
+"python-socketio[client]") connect with the profile's transports, register
+and receive a snapshot of --messages messages encoded the way app.py sends
+it, and disconnect. One more client then stays idle for --idle seconds with
+the ping interval shortened to one second, which gives the measured cost of
+a ping/pong round that is then scaled to the profile's real interval:
+
+    python benchmarks/transport.py --messages 50 --connections 20
+"""
+import os
+import sys
+import time
+import random
+import socket
+import string
+import logging
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_socketio import SocketIO, emit
+from werkzeug.serving import make_server
+from config import TRANSPORT_PROFILES
+from transport import socketio_options, pack_payload
+
+
+def sample_snapshot(count):
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(300)]
+    messages = []
+    for message_id in range(1, count + 1):
+        messages.append({
+            'id': message_id,
+            'username': random.choice(['rafay', 'ayesha', 'bilal', 'sana']),
+            'message': ' '.join(random.choices(words, k=random.randint(3, 30))),
+            'message_type': 'text',
+            'file_path': None,
+            'timestamp': '2025-05-18 16:21:14',
+            'statuses': {str(user_id): 'seen' for user_id in range(1, 6)}
+        })
+    return {'status': 'success', 'username': 'rafay', 'sync': 'snapshot', 'recent_messages': messages}
+
+
+class CountingProxy:
+    """Forward local TCP connections to a server, counting bytes both ways"""
+
+    def __init__(self, target_port):
+        self.target_port = target_port
+        self.lock = threading.Lock()
+        self.sent = 0      # server -> client
+        self.received = 0  # client -> server
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(('127.0.0.1', self.target_port))
+            threading.Thread(target=self._pump, args=(client, upstream, 'received'), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, 'sent'), daemon=True).start()
+
+    def _pump(self, source, destination, counter):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                with self.lock:
+                    setattr(self, counter, getattr(self, counter) + len(data))
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def take(self):
+        """Bytes (sent, received) since the last call"""
+        time.sleep(0.2)  # let in-flight frames through
+        with self.lock:
+            counts = self.sent, self.received
+            self.sent = self.received = 0
+        return counts
+
+    def close(self):
+        self.listener.close()
+
+
+def start_server(profile_name, snapshot):
+    threshold = TRANSPORT_PROFILES[profile_name]['payload_compression_threshold']
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading', **socketio_options(profile_name))
+
+    @socketio.on('register')
+    def register(data):
+        emit('registration_response', pack_payload(snapshot, threshold))
+
+    # The development server logs every request and a spurious error when a websocket closes
+    logging.getLogger('werkzeug').disabled = True
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return socketio, server
+
+
+def connect_and_register(socketio_client, url, transports, username):
+    client = socketio_client.Client()
+    received = threading.Event()
+    client.on('registration_response', lambda data: received.set())
+    client.connect(url, transports=transports)
+    client.emit('register', {'username': username})
+    if not received.wait(10):
+        client.disconnect()
+        raise RuntimeError(f"No registration_response for {username}")
+    return client
+
+
+def measure(profile_name, snapshot, connections, idle):
+    import socketio as socketio_client
+    profile = TRANSPORT_PROFILES[profile_name]
+    socketio, server = start_server(profile_name, snapshot)
+    proxy = CountingProxy(server.server_port)
+    url = f"http://127.0.0.1:{proxy.port}"
+    try:
+        timings = []
+        proxy.take()
+        for index in range(connections):
+            start = time.perf_counter()
+            client = connect_and_register(socketio_client, url, profile['transports'], f"bench{index}")
+            timings.append(time.perf_counter() - start)
+            client.disconnect()
+        sent, received = proxy.take()
+        session = (sent + received) // connections
+
+        # New connections read the ping interval from the server when they open
+        socketio.server.eio.ping_interval = 1
+        client = connect_and_register(socketio_client, url, profile['transports'], 'idle')
+        proxy.take()
+        time.sleep(idle)
+        sent, received = proxy.take()
+        client.disconnect()
+        per_ping = (sent + received) / idle
+    finally:
+        proxy.close()
+        server.shutdown()
+    return statistics.median(timings), session, per_ping * 3600 / profile['ping_interval']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--connections', type=int, default=10)
+    parser.add_argument('--idle', type=int, default=5, help='seconds of keep-alive to measure')
+    args = parser.parse_args()
+
+    try:
+        import socketio  # noqa: F401
+    except ImportError:
+        sys.exit('This benchmark needs the python-socketio client: pip install "python-socketio[client]"')
+    random.seed(1)
+    snapshot = sample_snapshot(args.messages)
+    print(f"Registration snapshot of {args.messages} messages, {args.connections} connections per profile")
+    print(f"{'profile':<10} {'transports':<20} {'connect+register':>17} {'bytes/session':>14} {'keepalive/h':>12}")
+    for name, profile in TRANSPORT_PROFILES.items():
+        median, session, keepalive = measure(name, snapshot, args.connections, args.idle)
+        print(f"{name:<10} {','.join(profile['transports']):<20} {median * 1000:>14.1f} ms "
+              f"{session:>14} {int(keepalive):>12}")
+    print("(bytes/session: connect, register, snapshot and disconnect on the wire, both directions)")
+
+
+if __name__ == '__main__':
+    main()
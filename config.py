@@ -19,3 +19,189 @@ DB_CONFIG = {
 }
 
 CORS_ALLOWED_ORIGINS = ['http://127.0.0.1:8000', 'http://localhost:8000', 'https://d450-223-123-112-226.ngrok-free.app']
+
+# Messages older than max_age_days are moved out of socket_messages into
+# compressed segment files under directory (see archive.py)
+ARCHIVE_CONFIG = {
+    'directory': 'archive',
+    'max_age_days': 30,
+    'batch_size': 1000,
+    'block_size': 100,
+    'segment_max_messages': 10000,
+    'interval_seconds': 3600
+}
+
+# Session activity is buffered in memory and written every flush_interval
+# seconds; sessions idle for longer than ttl_seconds are deleted
+SESSION_CONFIG = {
+    'flush_interval': 30,
+    'gc_interval': 300,
+    'ttl_seconds': 86400,
+    # With a message queue every worker renews its sessions each flush, and
+    # a session older than this belongs to a worker that is gone
+    'lease_seconds': 90
+}
+
+# Presence transitions are written and broadcast every snapshot_interval
+# seconds; registrations are admitted at `admission_rate` per second with
+# bursts of up to `admission_burst`
+PRESENCE_CONFIG = {
+    'snapshot_interval': 1,
+    'admission_rate': 20,
+    'admission_burst': 50
+}
+
+# Static files fingerprinted and precompressed by `python assets.py`; built
+# files are served from /assets/ with a one year immutable cache lifetime
+ASSET_CONFIG = {
+    'source': 'static',
+    'output': 'static/dist',
+    'files': ['css/styles.css', 'js/chat.js', 'js/socket.io.min.js'],
+    'compress_extensions': {'.css', '.js', '.svg', '.json'},
+    'max_age': 31536000
+}
+
+# Reconnecting clients send their last message id and receive only what they
+# missed, in pages of page_size; past snapshot_threshold missed messages they
+# get a fresh snapshot of the latest snapshot_size messages instead
+SYNC_CONFIG = {
+    'page_size': 100,
+    'snapshot_threshold': 500,
+    'snapshot_size': 50
+}
+
+# Read/delivery watermark advances are written every flush_interval seconds
+RECEIPT_CONFIG = {
+    'flush_interval': 2
+}
+
+# Engine.IO settings per deployment shape, selected by TRANSPORT_PROFILE.
+# payload_compression_threshold is the JSON size above which large events
+# (history snapshots and pages) are sent zlib-compressed
+TRANSPORT_PROFILES = {
+    'websocket': {
+        'transports': ['websocket'],
+        'ping_interval': 25,
+        'ping_timeout': 20,
+        'max_http_buffer_size': 16 * 1024 * 1024,
+        'http_compression': False,
+        'payload_compression_threshold': 8192
+    },
+    'polling': {
+        'transports': ['polling', 'websocket'],
+        'ping_interval': 25,
+        'ping_timeout': 20,
+        'max_http_buffer_size': 16 * 1024 * 1024,
+        'http_compression': True,
+        'compression_threshold': 1024,
+        'payload_compression_threshold': 8192
+    },
+    'mobile': {
+        'transports': ['websocket'],
+        'ping_interval': 50,
+        'ping_timeout': 40,
+        'max_http_buffer_size': 16 * 1024 * 1024,
+        'http_compression': False,
+        'payload_compression_threshold': 2048
+    }
+}
+TRANSPORT_PROFILE = 'websocket'
+
+# Multi-process launcher (launcher.py). workers = 0 uses one per CPU core;
+# more than one worker requires message_queue. The active user list and
+# username uniqueness then go through the session table, but some state is
+# still kept per worker: typing indicators, conference membership and which
+# online users a new message counts as delivered to only cover clients
+# connected to the same worker.
+# mode 'dispatch' routes every connection from a client IP to the same
+# worker, which long-polling needs; 'reuseport' lets the kernel balance
+# connections and is only sticky per TCP connection (websocket-only).
+# Broadcasts reach clients on other workers only through message_queue,
+# e.g. 'redis://localhost:6379/0'
+LAUNCHER_CONFIG = {
+    'host': '0.0.0.0',
+    'port': 8000,
+    'workers': 1,
+    'mode': 'dispatch',
+    'heartbeat_interval': 1,
+    'heartbeat_timeout': 10,
+    'grace_period': 10,
+    'message_queue': None
+}
+
+# Warm restarts: in-memory state is written to path every interval seconds
+# and on clean shutdown, and loaded on boot. Users the snapshot saw online
+# who have not reconnected reconcile_delay seconds after boot are marked
+# offline. window_size is the number of recent messages kept in memory;
+# with several workers the window re-reads the last catchup_overlap ids when
+# catching up, for messages another worker committed out of id order
+SNAPSHOT_CONFIG = {
+    'path': 'state/snapshot-{name}.bin',
+    'interval': 60,
+    'reconcile_delay': 30,
+    'window_size': 200,
+    'catchup_overlap': 50
+}
+
+# Workload capture (workload.py): when capture_path is set, every client event
+# the server handles is appended to it for later replay. {pid} is replaced by
+# the process id so launcher workers write separate files
+WORKLOAD_CONFIG = {
+    'capture_path': None
+}
+
+# new_message fan-out (fanout.py): above rate_threshold messages per second,
+# messages arriving within max_delay seconds are broadcast together as one
+# new_messages packet of at most max_batch messages
+FANOUT_CONFIG = {
+    'rate_threshold': 20,
+    'max_delay': 0.01,
+    'max_batch': 50
+}
+
+# Outbound queues (backpressure.py): a client with high_water packets waiting
+# to be sent is congested until it drains to low_water. Congested clients miss
+# typing and receipt broadcasts (the latest is sent once they recover) and are
+# disconnected after evict_after seconds, or at once past max_depth packets
+BACKPRESSURE_CONFIG = {
+    'high_water': 256,
+    'low_water': 64,
+    'evict_after': 30,
+    'max_depth': 4096,
+    'check_interval': 1
+}
+
+# Read endpoints replicating DB_CONFIG's database, with the same keys as
+# DB_CONFIG, e.g. {'host': '10.0.0.12', 'user': 'reader', 'password': '...',
+# 'database': 'Chatbot', 'port': 3306}. Lookups go to them round-robin; a
+# read that depends on a write this process made in the last sticky_seconds
+# (or while the replica may still be behind it) goes to the primary. Writes
+# are tracked per row where the row is known, so e.g. paging through older
+# history stays on the replicas while new messages are being sent. Replicas
+# over max_lag_seconds behind are skipped and unreachable ones are retried
+# after retry_after seconds. Lag is checked every lag_check_interval seconds
+# with SHOW REPLICA STATUS, which needs the REPLICATION CLIENT privilege
+# (GRANT REPLICATION CLIENT ON *.* TO 'reader'); without it the lag is
+# assumed to be max_lag_seconds
+DB_REPLICAS = []
+
+REPLICA_CONFIG = {
+    'max_lag_seconds': 5,
+    'sticky_seconds': 2,
+    'lag_check_interval': 5,
+    'retry_after': 30
+}
+
+# Upload storage (storage.py). Quotas are in bytes and counted in the
+# database, shared by all processes; the primary process re-counts from disk
+# each scan_interval seconds and moves files no message refers to (older
+# than orphan_min_age seconds) to trash, deleting them after trash_retention
+STORAGE_CONFIG = {
+    'trash': 'trash/uploads',
+    'user_quota': 200 * 1024 * 1024,
+    'global_quota': 20 * 1024 * 1024 * 1024,
+    'shard_levels': 2,
+    'scan_interval': 3600,
+    'orphan_min_age': 3600,
+    'trash_retention': 7 * 86400
+}
@@ -1,28 +1,75 @@
 import pymysql
 import time
 import logging
-from config import DB_CONFIG
+import threading
+from collections import OrderedDict
+from config import DB_CONFIG, DB_REPLICAS, REPLICA_CONFIG
 
-# Configure logging
+# Configure logging (the log file is only opened on the first record)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('database.log')
+        logging.FileHandler('database.log', delay=True)
     ]
 )
 logger = logging.getLogger(__name__)
 
+# MySQL error for a statement that needs a privilege the user lacks
+ER_SPECIFIC_ACCESS_DENIED = 1227
+
+class ReadReplica:
+    """Connection settings and health of one read endpoint"""
+    def __init__(self, config):
+        self.config = config
+        self.name = f"{config['host']}:{config.get('port', 3306)}"
+        self.lag = 0
+        self.lag_checked = 0.0
+        self.down_until = 0.0
+        self.lag_unknown = False
+
 class Database:
-    def __init__(self, max_retries=3, retry_delay=1):
+    def __init__(self, max_retries=3, retry_delay=1, replicas=DB_REPLICAS, init_retry_after=30):
+        # No connection is made here: tables are checked on first use or
+        # when startup() is called, so importing this module stays cheap
         self.connection = None
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.initialize_tables()
+        self.initialized = False
+        self.init_lock = threading.Lock()
+        self.init_retry_after = init_retry_after
+        self.init_failed_at = None
+        self.replicas = [ReadReplica(config) for config in replicas]
+        self.next_replica = 0
+        # table or (table, row) -> time of this process's last write to it
+        self.recent_writes = OrderedDict()
+        self.writes_lock = threading.Lock()
+    
+    def startup(self):
+        """Connect and check the schema once, safe to call repeatedly.
+
+        A failed check is tried again on a call init_retry_after seconds
+        later; calls in between skip it instead of queueing up behind it.
+        """
+        if self.initialized:
+            return
+        if self.init_failed_at is not None and time.monotonic() - self.init_failed_at < self.init_retry_after:
+            return
+        with self.init_lock:
+            if self.initialized:
+                return
+            if self.init_failed_at is not None and time.monotonic() - self.init_failed_at < self.init_retry_after:
+                return
+            self.initialized = self.initialize_tables()
+            self.init_failed_at = None if self.initialized else time.monotonic()
     
     def get_connection(self):
         """Get a new connection to the database with retry mechanism"""
+        self.startup()
+        return self._connect()
+
+    def _connect(self):
         retries = 0
         while retries < self.max_retries:
             try:
@@ -54,6 +101,162 @@ class Database:
                 logger.error(f"Unexpected error during connection: {e}")
                 raise
     
+    def _note_write(self, key):
+        """Remember a write so reads that depend on it stay on the primary for a while"""
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        horizon = now - max(REPLICA_CONFIG['sticky_seconds'], REPLICA_CONFIG['max_lag_seconds'] + 1)
+        with self.writes_lock:
+            self.recent_writes[key] = now
+            self.recent_writes.move_to_end(key)
+            while next(iter(self.recent_writes.values())) < horizon:
+                self.recent_writes.popitem(last=False)
+
+    def get_read_connection(self, *keys):
+        """Get a connection for a read, from a read replica when one can serve it.
+
+        keys name what the read depends on: a table (any write to it), a
+        (table, row) pair, or a (table, low, high) range of row ids
+        exclusive at both ends, None for unbounded. A replica is only used
+        once it has had time to replay this process's last write to any of
+        them, so callers read their own writes; with no usable replica the
+        read goes to the primary.
+        """
+        if not self.replicas:
+            return self.get_connection()
+        self.startup()
+        now = time.monotonic()
+        last_write = self._last_write(keys)
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self.next_replica % len(self.replicas)]
+            self.next_replica += 1
+            if replica.down_until > now:
+                continue
+            # Seconds_Behind_Source is whole seconds, hence the extra second
+            if now - last_write < max(REPLICA_CONFIG['sticky_seconds'], replica.lag + 1):
+                continue
+            connection = self._connect_replica(replica, now)
+            if connection:
+                return connection
+        return self.get_connection()
+
+    def _last_write(self, keys):
+        """Time of this process's most recent write that a read of keys depends on"""
+        with self.writes_lock:
+            # Newest first, so the first match is the answer
+            for written, at in reversed(self.recent_writes.items()):
+                if any(self._depends_on(key, written) for key in keys):
+                    return at
+        return 0.0
+
+    @staticmethod
+    def _depends_on(key, written):
+        if isinstance(written, str):
+            # A write without a row may have touched any row of the table
+            return (key if isinstance(key, str) else key[0]) == written
+        if isinstance(key, str):
+            return key == written[0]
+        if key[0] != written[0]:
+            return False
+        if len(key) == 2:
+            return key[1] == written[1]
+        low, high = key[1], key[2]
+        return (low is None or written[1] > low) and (high is None or written[1] < high)
+
+    def _connect_replica(self, replica, now):
+        """Connect to a replica, checking its lag every lag_check_interval seconds"""
+        try:
+            connection = pymysql.connect(
+                host=replica.config['host'],
+                user=replica.config['user'],
+                password=replica.config['password'],
+                database=replica.config['database'],
+                port=replica.config.get('port', 3306),
+                cursorclass=pymysql.cursors.DictCursor,
+                charset='utf8mb4',
+                connect_timeout=2,
+                read_timeout=30,
+                write_timeout=30,
+                autocommit=True
+            )
+        except pymysql.Error as e:
+            replica.down_until = now + REPLICA_CONFIG['retry_after']
+            logger.error(f"Read replica {replica.name} unavailable, retrying in {REPLICA_CONFIG['retry_after']}s: {e}")
+            return None
+        if now - replica.lag_checked < REPLICA_CONFIG['lag_check_interval']:
+            return connection
+        replica.lag_checked = now
+        lag = self._replica_lag(replica, connection)
+        if lag is None:
+            replica.down_until = now + REPLICA_CONFIG['retry_after']
+            logger.error(f"Read replica {replica.name} is not replicating, retrying in {REPLICA_CONFIG['retry_after']}s")
+        elif lag > REPLICA_CONFIG['max_lag_seconds']:
+            replica.lag = lag
+            replica.down_until = now + REPLICA_CONFIG['lag_check_interval']
+            logger.warning(f"Read replica {replica.name} is {lag}s behind, skipping it")
+        else:
+            replica.lag = lag
+            return connection
+        self.close_connection(connection)
+        return None
+
+    def _replica_lag(self, replica, connection):
+        """Return the replication lag in seconds, 0 for a standalone server, None if unknown"""
+        try:
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except pymysql.Error as e:
+                    if e.args[0] == ER_SPECIFIC_ACCESS_DENIED:
+                        raise
+                    # MySQL before 8.0.22 and MariaDB only know the old name
+                    cursor.execute("SHOW SLAVE STATUS")
+                status = cursor.fetchone()
+        except pymysql.Error as e:
+            if e.args[0] == ER_SPECIFIC_ACCESS_DENIED:
+                # The replica works, its lag just cannot be seen; assume the
+                # most that is tolerated so reads after a write stay on the primary
+                if not replica.lag_unknown:
+                    replica.lag_unknown = True
+                    logger.error(f"Cannot check lag of read replica {replica.name}, its user needs the "
+                                 f"REPLICATION CLIENT privilege; assuming {REPLICA_CONFIG['max_lag_seconds']}s: {e}")
+                return REPLICA_CONFIG['max_lag_seconds']
+            logger.error(f"Error checking replica lag: {e}")
+            return None
+        if not status:
+            # Not a replica at all, e.g. a second local instance used as a stand-in
+            return 0
+        return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+
+    def stream_rows(self, table, order_by='id'):
+        """Yield every row of a table through an unbuffered server-side cursor.
+
+        Rows are fetched from the server as they are consumed, so memory use
+        stays flat however large the table is. The cursor needs a connection
+        of its own because no other query can run until it is exhausted.
+        """
+        self.startup()
+        connection = pymysql.connect(
+            host=DB_CONFIG['host'],
+            user=DB_CONFIG['user'],
+            password=DB_CONFIG['password'],
+            database=DB_CONFIG['database'],
+            port=DB_CONFIG['port'],
+            cursorclass=pymysql.cursors.SSDictCursor,
+            charset='utf8mb4',
+            connect_timeout=10,
+            autocommit=True
+        )
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT * FROM {table} ORDER BY {order_by}")
+                for row in cursor:
+                    yield row
+            logger.info(f"Streamed all rows of {table}")
+        finally:
+            connection.close()
+
     def close_connection(self, connection=None):
         """Safely close the database connection"""
         conn_to_close = connection or self.connection
@@ -68,10 +271,10 @@ class Database:
                 self.connection = None
     
     def initialize_tables(self):
-        """Initialize the database tables if they don't exist"""
+        """Initialize the database tables if they don't exist, returns True on success"""
         connection = None
         try:
-            connection = self.get_connection()
+            connection = self._connect()
             with connection.cursor() as cursor:
                 # Create socket_users table
                 cursor.execute("""
@@ -124,15 +327,69 @@ class Database:
                         FOREIGN KEY (user_id) REFERENCES socket_users(id)
                     ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
                 """)
+
+                # Create socket_read_watermarks table (per-user read/delivery position)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS socket_read_watermarks (
+                        user_id INT NOT NULL,
+                        channel VARCHAR(50) NOT NULL DEFAULT 'global',
+                        last_delivered_id INT NOT NULL DEFAULT 0,
+                        last_seen_id INT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, channel),
+                        FOREIGN KEY (user_id) REFERENCES socket_users(id)
+                    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+                """)
+
+                # Create socket_upload_usage table (bytes of uploads per user,
+                # user_id 0 holds the total across users)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS socket_upload_usage (
+                        user_id INT PRIMARY KEY,
+                        bytes BIGINT NOT NULL DEFAULT 0
+                    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+                """)
+
+                # Session updates and lookups are keyed on socket_id
+                self.ensure_index(cursor, 'socket_user_sessions', 'idx_socket_id', 'socket_id')
+                self.ensure_index(cursor, 'socket_user_sessions', 'idx_last_active', 'last_active')
+
+                # One status row per message and user, so imports can skip rows they already wrote.
+                # Rows duplicated by racing writers before the key existed keep only the newest
+                if not self.index_exists(cursor, 'socket_message_status', 'uniq_message_user'):
+                    cursor.execute("""
+                        DELETE s FROM socket_message_status s
+                        JOIN socket_message_status newer
+                          ON newer.message_id = s.message_id AND newer.user_id = s.user_id AND newer.id > s.id
+                    """)
+                    self.ensure_index(cursor, 'socket_message_status', 'uniq_message_user',
+                                      'message_id, user_id', unique=True)
                 logger.info("Database tables initialized successfully")
+                return True
         except pymysql.Error as e:
             logger.error(f"Error initializing tables: {e}")
+            return False
         except Exception as e:
             logger.error(f"Unexpected error during table initialization: {e}")
+            return False
         finally:
             self.close_connection(connection)
     
-    def save_user(self, username):
+    def index_exists(self, cursor, table, index_name):
+        cursor.execute("""
+            SELECT COUNT(*) AS count
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, index_name))
+        return cursor.fetchone()['count'] > 0
+
+    def ensure_index(self, cursor, table, index_name, columns, unique=False):
+        """Create an index unless it already exists"""
+        if not self.index_exists(cursor, table, index_name):
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table} ({columns})")
+            logger.info(f"Created index {index_name} on {table}")
+
+    def save_user(self, username, set_online=True):
         """Save a new user or get existing user id"""
         connection = None
         try:
@@ -142,19 +399,22 @@ class Database:
                 user = cursor.fetchone()
                 
                 if user:
-                    cursor.execute("""
-                        UPDATE socket_users 
-                        SET status = 'online', last_seen = CURRENT_TIMESTAMP 
-                        WHERE id = %s
-                    """, (user['id'],))
-                    logger.info(f"User {username} status updated to online")
+                    if set_online:
+                        cursor.execute("""
+                            UPDATE socket_users 
+                            SET status = 'online', last_seen = CURRENT_TIMESTAMP 
+                            WHERE id = %s
+                        """, (user['id'],))
+                        self._note_write(('socket_users', user['id']))
+                        logger.info(f"User {username} status updated to online")
                     return user['id']
                 
                 cursor.execute("""
                     INSERT INTO socket_users (username, status, created_at) 
-                    VALUES (%s, 'online', CURRENT_TIMESTAMP)
-                """, (username,))
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                """, (username, 'online' if set_online else 'offline'))
                 user_id = cursor.lastrowid
+                self._note_write(('socket_users', user_id))
                 logger.info(f"New user {username} created with ID {user_id}")
                 return user_id
         except pymysql.Error as e:
@@ -175,12 +435,13 @@ class Database:
                 """, (user_id, message, message_type, file_path))
                 
                 cursor.execute("""
-                    SELECT m.id, m.message, m.message_type, m.file_path, m.created_at, u.username 
+                    SELECT m.id, m.user_id, m.message, m.message_type, m.file_path, m.created_at, u.username 
                     FROM socket_messages m 
                     JOIN socket_users u ON m.user_id = u.id 
                     WHERE m.id = LAST_INSERT_ID()
                 """)
                 message_data = cursor.fetchone()
+                self._note_write(('socket_messages', message_data['id']))
                 logger.info(f"Message saved: ID {message_data['id']}, Type {message_type}, User ID {user_id}")
                 return message_data
         except pymysql.Error as e:
@@ -193,13 +454,13 @@ class Database:
         """Get recent messages from the database"""
         connection = None
         try:
-            connection = self.get_connection()
+            connection = self.get_read_connection('socket_messages')
             with connection.cursor() as cursor:
                 cursor.execute("""
-                    SELECT m.id, m.message, m.message_type, m.file_path, m.created_at, u.username 
-                    FROM socket_messages m 
-                    JOIN socket_users u ON m.user_id = u.id 
-                    ORDER BY m.created_at DESC 
+                    SELECT m.id, m.user_id, m.message, m.message_type, m.file_path, m.created_at, u.username
+                    FROM socket_messages m
+                    JOIN socket_users u ON m.user_id = u.id
+                    ORDER BY m.id DESC
                     LIMIT %s
                 """, (limit,))
                 messages = cursor.fetchall()
@@ -222,6 +483,7 @@ class Database:
                     SET status = %s, last_seen = CURRENT_TIMESTAMP 
                     WHERE id = %s
                 """, (status, user_id))
+                self._note_write(('socket_users', user_id))
                 logger.info(f"User ID {user_id} status updated to {status}")
                 return True
         except pymysql.Error as e:
@@ -230,11 +492,53 @@ class Database:
         finally:
             self.close_connection(connection)
     
+    def set_users_status(self, user_ids, status='offline'):
+        """Update the status of many users in one statement"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                placeholders = ', '.join(['%s'] * len(user_ids))
+                cursor.execute(f"""
+                    UPDATE socket_users
+                    SET status = %s, last_seen = CURRENT_TIMESTAMP
+                    WHERE id IN ({placeholders})
+                """, [status] + list(user_ids))
+                self._note_write('socket_users')
+                logger.info(f"{len(user_ids)} users status updated to {status}")
+                return True
+        except pymysql.Error as e:
+            logger.error(f"Error updating status for {len(user_ids)} users: {e}")
+            return False
+        finally:
+            self.close_connection(connection)
+
+    def reset_online_users(self):
+        """Mark every user offline, used at startup when no socket can be connected yet"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE socket_users
+                    SET status = 'offline'
+                    WHERE status = 'online'
+                """)
+                reset = cursor.rowcount
+                self._note_write('socket_users')
+                logger.info(f"Reset {reset} stale online users to offline")
+                return reset
+        except pymysql.Error as e:
+            logger.error(f"Error resetting online users: {e}")
+            return 0
+        finally:
+            self.close_connection(connection)
+
     def get_active_users(self):
         """Get all active users from the database"""
         connection = None
         try:
-            connection = self.get_connection()
+            connection = self.get_read_connection('socket_users')
             with connection.cursor() as cursor:
                 cursor.execute("""
                     SELECT id, username, avatar, last_seen
@@ -263,6 +567,7 @@ class Database:
                     VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
                 """, (user_id, socket_id, ip_address, user_agent))
                 session_id = cursor.lastrowid
+                self._note_write(('socket_user_sessions', socket_id))
                 logger.info(f"Session saved for user ID {user_id}, Socket ID {socket_id}")
                 return session_id
         except pymysql.Error as e:
@@ -271,6 +576,67 @@ class Database:
         finally:
             self.close_connection(connection)
     
+    def claim_user_session(self, user_id, socket_id, ip_address=None, user_agent=None, lease_seconds=90):
+        """Save a session unless the user has one another process kept alive.
+
+        Sessions not touched for lease_seconds belong to a process that is
+        gone and are dropped. The user row is locked for the check, so two
+        processes cannot both claim the same user. Returns True when
+        claimed, False when the user is connected elsewhere, None on error.
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            connection.begin()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id FROM socket_users WHERE id = %s FOR UPDATE", (user_id,))
+                cursor.execute("""
+                    DELETE FROM socket_user_sessions
+                    WHERE user_id = %s AND last_active < NOW() - INTERVAL %s SECOND
+                """, (user_id, lease_seconds))
+                cursor.execute("SELECT COUNT(*) AS count FROM socket_user_sessions WHERE user_id = %s", (user_id,))
+                if cursor.fetchone()['count']:
+                    connection.rollback()
+                    logger.info(f"User ID {user_id} already has a live session")
+                    return False
+                cursor.execute("""
+                    INSERT INTO socket_user_sessions
+                    (user_id, socket_id, ip_address, user_agent, connected_at, last_active)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                """, (user_id, socket_id, ip_address, user_agent))
+            connection.commit()
+            self._note_write(('socket_user_sessions', socket_id))
+            logger.info(f"Session claimed for user ID {user_id}, Socket ID {socket_id}")
+            return True
+        except pymysql.Error as e:
+            if connection is not None and connection.open:
+                connection.rollback()
+            logger.error(f"Error claiming session for user ID {user_id}: {e}")
+            return None
+        finally:
+            self.close_connection(connection)
+
+    def get_live_session_users(self, lease_seconds=90):
+        """Get {user_id: username} of every user with a session touched in the last lease_seconds"""
+        connection = None
+        try:
+            connection = self.get_read_connection('socket_user_sessions')
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT DISTINCT u.id, u.username
+                    FROM socket_user_sessions s
+                    JOIN socket_users u ON s.user_id = u.id
+                    WHERE s.last_active >= NOW() - INTERVAL %s SECOND
+                """, (lease_seconds,))
+                users = {row['id']: row['username'] for row in cursor.fetchall()}
+                logger.info(f"Retrieved {len(users)} users with live sessions")
+                return users
+        except pymysql.Error as e:
+            logger.error(f"Error getting users with live sessions: {e}")
+            return {}
+        finally:
+            self.close_connection(connection)
+
     def update_user_session(self, socket_id):
         """Update user session last active timestamp"""
         connection = None
@@ -290,11 +656,71 @@ class Database:
         finally:
             self.close_connection(connection)
     
+    def touch_user_sessions(self, socket_ids):
+        """Update last active timestamp for many sessions in one statement"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                placeholders = ', '.join(['%s'] * len(socket_ids))
+                cursor.execute(f"""
+                    UPDATE socket_user_sessions
+                    SET last_active = CURRENT_TIMESTAMP
+                    WHERE socket_id IN ({placeholders})
+                """, socket_ids)
+                logger.info(f"Sessions updated for {len(socket_ids)} Socket IDs")
+                return True
+        except pymysql.Error as e:
+            logger.error(f"Error updating {len(socket_ids)} sessions: {e}")
+            return False
+        finally:
+            self.close_connection(connection)
+
+    def close_user_session(self, socket_id):
+        """Delete the session of a disconnected socket"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM socket_user_sessions WHERE socket_id = %s", (socket_id,))
+                self._note_write(('socket_user_sessions', socket_id))
+                logger.info(f"Session closed for Socket ID {socket_id}")
+                return True
+        except pymysql.Error as e:
+            logger.error(f"Error closing session for Socket ID {socket_id}: {e}")
+            return False
+        finally:
+            self.close_connection(connection)
+
+    def delete_stale_sessions(self, ttl_seconds, active_socket_ids=()):
+        """Delete sessions idle for longer than ttl_seconds, except the given live sockets"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                query = """
+                    DELETE FROM socket_user_sessions
+                    WHERE last_active < NOW() - INTERVAL %s SECOND
+                """
+                params = [ttl_seconds]
+                if active_socket_ids:
+                    query += f" AND socket_id NOT IN ({', '.join(['%s'] * len(active_socket_ids))})"
+                    params.extend(active_socket_ids)
+                cursor.execute(query, params)
+                deleted = cursor.rowcount
+                logger.info(f"Deleted {deleted} stale sessions idle for more than {ttl_seconds} seconds")
+                return deleted
+        except pymysql.Error as e:
+            logger.error(f"Error deleting stale sessions: {e}")
+            return 0
+        finally:
+            self.close_connection(connection)
+
     def get_user_by_socket_id(self, socket_id):
         """Get user information by socket ID"""
         connection = None
         try:
-            connection = self.get_connection()
+            connection = self.get_read_connection(('socket_user_sessions', socket_id))
             with connection.cursor() as cursor:
                 cursor.execute("""
                     SELECT u.id, u.username, u.status, u.avatar 
@@ -334,6 +760,7 @@ class Database:
                         INSERT INTO socket_message_status (message_id, user_id, status, updated_at) 
                         VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
                     """, (message_id, user_id, status))
+                self._note_write(('socket_message_status', message_id))
                 logger.info(f"Message {message_id} status updated to {status} for user {user_id}")
                 return True
         except pymysql.Error as e:
@@ -346,7 +773,7 @@ class Database:
         """Get status for a message"""
         connection = None
         try:
-            connection = self.get_connection()
+            connection = self.get_read_connection(('socket_message_status', message_id))
             with connection.cursor() as cursor:
                 cursor.execute("""
                     SELECT user_id, status 
@@ -362,5 +789,325 @@ class Database:
         finally:
             self.close_connection(connection)
 
+    def get_messages_before(self, before_id, limit=50):
+        """Get the messages preceding a message id, oldest first"""
+        connection = None
+        try:
+            connection = self.get_read_connection(('socket_messages', None, before_id))
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT m.id, m.user_id, m.message, m.message_type, m.file_path, m.created_at, u.username
+                    FROM socket_messages m
+                    JOIN socket_users u ON m.user_id = u.id
+                    WHERE m.id < %s
+                    ORDER BY m.id DESC
+                    LIMIT %s
+                """, (before_id, limit))
+                messages = cursor.fetchall()
+                logger.info(f"Retrieved {len(messages)} messages before ID {before_id}")
+                return list(reversed(messages)) if messages else []
+        except pymysql.Error as e:
+            logger.error(f"Error getting messages before ID {before_id}: {e}")
+            return []
+        finally:
+            self.close_connection(connection)
+
+    def get_messages_after(self, after_id, limit=100):
+        """Get the messages following a message id, oldest first"""
+        connection = None
+        try:
+            connection = self.get_read_connection(('socket_messages', after_id, None))
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT m.id, m.user_id, m.message, m.message_type, m.file_path, m.created_at, u.username
+                    FROM socket_messages m
+                    JOIN socket_users u ON m.user_id = u.id
+                    WHERE m.id > %s
+                    ORDER BY m.id ASC
+                    LIMIT %s
+                """, (after_id, limit))
+                messages = cursor.fetchall()
+                logger.info(f"Retrieved {len(messages)} messages after ID {after_id}")
+                return list(messages)
+        except pymysql.Error as e:
+            logger.error(f"Error getting messages after ID {after_id}: {e}")
+            return []
+        finally:
+            self.close_connection(connection)
+
+    def count_messages_after(self, after_id):
+        """Count the messages following a message id"""
+        connection = None
+        try:
+            connection = self.get_read_connection(('socket_messages', after_id, None))
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) AS count FROM socket_messages WHERE id > %s", (after_id,))
+                count = cursor.fetchone()['count']
+                logger.info(f"Counted {count} messages after ID {after_id}")
+                return count
+        except pymysql.Error as e:
+            logger.error(f"Error counting messages after ID {after_id}: {e}")
+            return None
+        finally:
+            self.close_connection(connection)
+
+    def get_watermarks(self, channel='global'):
+        """Get read/delivery watermarks of every user, as {user_id: {'delivered': id, 'seen': id}}"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT user_id, last_delivered_id, last_seen_id
+                    FROM socket_read_watermarks
+                    WHERE channel = %s
+                """, (channel,))
+                watermarks = {
+                    row['user_id']: {'delivered': row['last_delivered_id'], 'seen': row['last_seen_id']}
+                    for row in cursor.fetchall()
+                }
+                logger.info(f"Retrieved watermarks for {len(watermarks)} users in {channel}")
+                return watermarks
+        except pymysql.Error as e:
+            logger.error(f"Error getting watermarks for {channel}: {e}")
+            return {}
+        finally:
+            self.close_connection(connection)
+
+    def save_watermarks(self, channel, rows):
+        """Upsert (user_id, last_delivered_id, last_seen_id) rows, never moving a watermark back"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+                params = []
+                for user_id, delivered_id, seen_id in rows:
+                    params.extend([user_id, channel, delivered_id, seen_id])
+                cursor.execute(f"""
+                    INSERT INTO socket_read_watermarks (user_id, channel, last_delivered_id, last_seen_id)
+                    VALUES {placeholders}
+                    ON DUPLICATE KEY UPDATE
+                        last_delivered_id = GREATEST(last_delivered_id, VALUES(last_delivered_id)),
+                        last_seen_id = GREATEST(last_seen_id, VALUES(last_seen_id))
+                """, params)
+                logger.info(f"Watermarks saved for {len(rows)} users in {channel}")
+                return True
+        except pymysql.Error as e:
+            logger.error(f"Error saving watermarks for {len(rows)} users in {channel}: {e}")
+            return False
+        finally:
+            self.close_connection(connection)
+
+    def migrate_message_status_to_watermarks(self, channel='global'):
+        """Build watermarks from the per-message socket_message_status rows"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO socket_read_watermarks (user_id, channel, last_delivered_id, last_seen_id)
+                    SELECT user_id, %s, MAX(message_id),
+                           COALESCE(MAX(CASE WHEN status = 'seen' THEN message_id END), 0)
+                    FROM socket_message_status
+                    GROUP BY user_id
+                    ON DUPLICATE KEY UPDATE
+                        last_delivered_id = GREATEST(last_delivered_id, VALUES(last_delivered_id)),
+                        last_seen_id = GREATEST(last_seen_id, VALUES(last_seen_id))
+                """, (channel,))
+                cursor.execute("SELECT COUNT(*) AS count FROM socket_read_watermarks WHERE channel = %s", (channel,))
+                count = cursor.fetchone()['count']
+                logger.info(f"Migrated message status rows to watermarks for {count} users in {channel}")
+                return count
+        except pymysql.Error as e:
+            logger.error(f"Error migrating message status to watermarks: {e}")
+            return 0
+        finally:
+            self.close_connection(connection)
+
+    def insert_rows(self, table, columns, rows):
+        """Insert many rows with one multi-row INSERT, skipping rows that already exist.
+
+        Only duplicate keys are skipped; a foreign key or data error fails the
+        whole batch, and any warning the server raises is logged.
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+                params = [row[column] for row in rows for column in columns]
+                cursor.execute(f"""
+                    INSERT INTO {table} ({', '.join(columns)})
+                    VALUES {', '.join([row_placeholder] * len(rows))}
+                    ON DUPLICATE KEY UPDATE {columns[0]} = {columns[0]}
+                """, params)
+                self._note_write(table)
+                for level, code, message in connection.show_warnings() or ():
+                    logger.error(f"Insert into {table} raised {level} {code}: {message}")
+                logger.info(f"Inserted {cursor.rowcount} of {len(rows)} rows into {table}")
+                return True
+        except pymysql.Error as e:
+            logger.error(f"Error inserting {len(rows)} rows into {table}: {e}")
+            return False
+        finally:
+            self.close_connection(connection)
+
+    def get_file_messages(self):
+        """Get the owner of every uploaded file messages refer to, None on error"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT user_id, file_path
+                    FROM socket_messages
+                    WHERE file_path IS NOT NULL
+                """)
+                rows = cursor.fetchall()
+                logger.info(f"Retrieved {len(rows)} file messages")
+                return {row['file_path']: row['user_id'] for row in rows}
+        except pymysql.Error as e:
+            logger.error(f"Error getting file messages: {e}")
+            return None
+        finally:
+            self.close_connection(connection)
+
+    def get_upload_usage(self):
+        """Get upload bytes per user as {user_id: bytes}, key 0 is the total; None on error"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT user_id, bytes FROM socket_upload_usage")
+                usage = {row['user_id']: row['bytes'] for row in cursor.fetchall()}
+                logger.info(f"Retrieved upload usage of {len(usage)} users")
+                return usage
+        except pymysql.Error as e:
+            logger.error(f"Error getting upload usage: {e}")
+            return None
+        finally:
+            self.close_connection(connection)
+
+    def reserve_upload_bytes(self, user_id, size, user_quota, global_quota):
+        """Count size bytes against a user and the total if both stay within quota.
+
+        Returns 'ok', 'user_quota' or 'global_quota' for the quota that would
+        be exceeded, None on error. The conditional updates make the check
+        and the increment one step, so concurrent uploads from any process
+        cannot overshoot a quota together.
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO socket_upload_usage (user_id, bytes) VALUES (0, 0), (%s, 0)
+                    ON DUPLICATE KEY UPDATE bytes = bytes
+                """, (user_id,))
+                cursor.execute("""
+                    UPDATE socket_upload_usage SET bytes = bytes + %s
+                    WHERE user_id = %s AND bytes + %s <= %s
+                """, (size, user_id, size, user_quota))
+                if not cursor.rowcount:
+                    return 'user_quota'
+                cursor.execute("""
+                    UPDATE socket_upload_usage SET bytes = bytes + %s
+                    WHERE user_id = 0 AND bytes + %s <= %s
+                """, (size, size, global_quota))
+                if not cursor.rowcount:
+                    cursor.execute("UPDATE socket_upload_usage SET bytes = bytes - %s WHERE user_id = %s",
+                                   (size, user_id))
+                    return 'global_quota'
+                return 'ok'
+        except pymysql.Error as e:
+            logger.error(f"Error reserving {size} upload bytes for user ID {user_id}: {e}")
+            return None
+        finally:
+            self.close_connection(connection)
+
+    def add_upload_usage(self, deltas):
+        """Add {user_id: bytes} (negative to release) to the upload usage"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.executemany("""
+                    INSERT INTO socket_upload_usage (user_id, bytes) VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE bytes = bytes + VALUES(bytes)
+                """, list(deltas.items()))
+                logger.info(f"Upload usage updated for {len(deltas)} users")
+                return True
+        except pymysql.Error as e:
+            logger.error(f"Error updating upload usage: {e}")
+            return False
+        finally:
+            self.close_connection(connection)
+
+    def get_archivable_messages(self, max_age_days, limit=1000):
+        """Get the oldest messages older than max_age_days, with their statuses.
+
+        Stops at the first message by id that is not old enough yet, so the
+        archive only ever receives an unbroken run of ids.
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT m.id, m.user_id, m.message, m.message_type, m.file_path, m.created_at, u.username,
+                           m.created_at < NOW() - INTERVAL %s DAY AS expired
+                    FROM socket_messages m
+                    JOIN socket_users u ON m.user_id = u.id
+                    ORDER BY m.id ASC
+                    LIMIT %s
+                """, (max_age_days, limit))
+                messages = []
+                for m in cursor.fetchall():
+                    if not m.pop('expired'):
+                        break
+                    messages.append(m)
+                if messages:
+                    ids = [m['id'] for m in messages]
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(f"""
+                        SELECT message_id, user_id, status
+                        FROM socket_message_status
+                        WHERE message_id IN ({placeholders})
+                    """, ids)
+                    statuses = {}
+                    for row in cursor.fetchall():
+                        statuses.setdefault(row['message_id'], {})[row['user_id']] = row['status']
+                    for m in messages:
+                        m['created_at'] = m['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+                        m['statuses'] = statuses.get(m['id'], {})
+                logger.info(f"Retrieved {len(messages)} archivable messages older than {max_age_days} days")
+                return messages
+        except pymysql.Error as e:
+            logger.error(f"Error getting archivable messages: {e}")
+            return []
+        finally:
+            self.close_connection(connection)
+
+    def delete_messages(self, message_ids):
+        """Delete the given messages and their status rows"""
+        connection = None
+        try:
+            connection = self.get_connection()
+            with connection.cursor() as cursor:
+                placeholders = ', '.join(['%s'] * len(message_ids))
+                cursor.execute(f"DELETE FROM socket_message_status WHERE message_id IN ({placeholders})", message_ids)
+                status_count = cursor.rowcount
+                cursor.execute(f"DELETE FROM socket_messages WHERE id IN ({placeholders})", message_ids)
+                message_count = cursor.rowcount
+                self._note_write('socket_messages')
+                logger.info(f"Deleted {message_count} messages and {status_count} status rows up to ID {max(message_ids)}")
+                return message_count
+        except pymysql.Error as e:
+            logger.error(f"Error deleting {len(message_ids)} messages: {e}")
+            return 0
+        finally:
+            self.close_connection(connection)
+
 # Singleton instance
 db = Database()
\ No newline at end of file
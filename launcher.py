@@ -0,0 +1,369 @@
+"""Pre-forking launcher that runs the chat server on every CPU core.
+
+    python launcher.py --workers 4 --mode dispatch
+
+The master process forks the workers and supervises them: each worker writes
+a heartbeat to a pipe, and a worker that exits or stops beating is replaced.
+SIGHUP restarts the workers one at a time (the replacement must be healthy
+before the old worker is drained), SIGTERM/SIGINT stop everything.
+
+In 'dispatch' mode the master owns the listening socket, accepts connections
+and passes each one to the worker chosen by a hash of the client IP, so the
+long-polling requests and the websocket upgrade of an Engine.IO session all
+reach the same worker. In 'reuseport' mode every worker binds the port with
+SO_REUSEPORT and the kernel balances connections.
+"""
+import os
+import sys
+import time
+import zlib
+import errno
+import signal
+import socket
+import logging
+import argparse
+import selectors
+from config import LAUNCHER_CONFIG
+
+logger = logging.getLogger('launcher')
+
+
+class PassedSocketListener:
+    """Listening-socket stand-in for a worker in dispatch mode.
+
+    accept() returns the connections the master sends over the worker's
+    channel, so eventlet's WSGI server can serve them unchanged.
+    """
+
+    family = socket.AF_INET
+
+    def __init__(self, channel, address):
+        self.channel = channel
+        self.address = address
+
+    def accept(self):
+        from eventlet import greenio, patcher
+        from eventlet.hubs import trampoline
+        original_socket = patcher.original('socket')
+        while True:
+            trampoline(self.channel.fileno(), read=True)
+            try:
+                message, fds, _, _ = original_socket.recv_fds(self.channel, 1, 1)
+            except BlockingIOError:
+                continue
+            if not message:
+                # The master closed our channel: it is retiring this worker.
+                # ESHUTDOWN (unlike EBADF) makes eventlet's server loop exit
+                raise OSError(errno.ESHUTDOWN, 'Dispatcher channel closed')
+            if fds:
+                connection = original_socket.socket(fileno=fds[0])
+                try:
+                    peer = connection.getpeername()
+                except OSError:
+                    connection.close()
+                    continue
+                return greenio.GreenSocket(connection), peer
+
+    def getsockname(self):
+        return self.address
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def close(self):
+        self.channel.close()
+
+
+def run_worker(slot, primary, mode, address, channel, heartbeat_fd):
+    """Serve the app in this (freshly forked) process, never returns"""
+    import eventlet
+    eventlet.monkey_patch()
+    from eventlet import wsgi
+    import app as chat
+
+    if mode == 'dispatch':
+        channel.setblocking(False)
+        listener = PassedSocketListener(channel, address)
+    else:
+        listener = eventlet.listen(address, reuse_port=True)
+
+    def heartbeat():
+        while True:
+            try:
+                os.write(heartbeat_fd, b'.')
+            except OSError:
+                os._exit(0)  # master is gone
+            eventlet.sleep(LAUNCHER_CONFIG['heartbeat_interval'])
+
+    def shutdown():
+        # Stop taking connections, give in-flight requests time to finish;
+        # dropped clients reconnect to another worker and resume from there
+        server.kill()
+        if mode == 'reuseport':
+            listener.close()
+        chat.save_state(f"worker{slot}", clean=chat.flush_pending())
+        eventlet.sleep(LAUNCHER_CONFIG['grace_period'])
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: eventlet.spawn_n(shutdown))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    eventlet.spawn(heartbeat)
+    # Presence was already reset by the master, only the caches are restored
+    chat.restore_state(f"worker{slot}")
+    chat.start_background_jobs(primary)
+    chat.socketio.start_background_task(chat.snapshot_job, f"worker{slot}")
+    logger.info(f"Worker {slot} (pid {os.getpid()}) serving in {mode} mode")
+    server = eventlet.spawn(wsgi.server, listener, chat.app, log_output=False)
+    try:
+        server.wait()
+    except BaseException as e:
+        logger.info(f"Worker {slot} server stopped: {e!r}")
+    eventlet.sleep(LAUNCHER_CONFIG['grace_period'])
+    os._exit(0)
+
+
+class Worker:
+    def __init__(self, slot, pid, channel, heartbeat_fd):
+        self.slot = slot
+        self.pid = pid
+        self.channel = channel          # master end of the dispatch channel
+        self.heartbeat_fd = heartbeat_fd
+        self.started = time.monotonic()
+        self.last_beat = self.started
+        self.healthy = False            # set by the first heartbeat
+
+
+class Master:
+    def __init__(self, host, port, workers, mode):
+        self.address = (host, port)
+        self.count = workers
+        self.mode = mode
+        self.slots = {}       # slot -> Worker serving it
+        self.starting = {}    # slot -> replacement Worker not yet healthy
+        self.draining = set() # pids being stopped on purpose
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        self.restart_queue = []
+        self.restart_requested = False
+        self.stopping = False
+
+    def spawn(self, slot):
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # Keep only this worker's ends, so closing a channel in the
+                # master is seen as EOF by the worker that owns it
+                os.close(read_fd)
+                channel.close()
+                for other in list(self.slots.values()) + list(self.starting.values()):
+                    other.channel.close()
+                    os.close(other.heartbeat_fd)
+                self.selector.close()
+                if self.listener:
+                    self.listener.close()
+                run_worker(slot, slot == 0, self.mode, self.address, worker_channel, write_fd)
+            except BaseException:
+                logger.exception(f"Worker {slot} failed")
+            finally:
+                os._exit(1)
+        os.close(write_fd)
+        worker_channel.close()
+        channel.settimeout(1)  # a stuck worker must not block the accept loop
+        os.set_blocking(read_fd, False)
+        worker = Worker(slot, pid, channel, read_fd)
+        self.selector.register(read_fd, selectors.EVENT_READ, ('heartbeat', worker))
+        logger.info(f"Started worker {slot} (pid {pid})")
+        return worker
+
+    def release(self, worker):
+        """Close the master's ends of a worker's heartbeat pipe and channel"""
+        try:
+            self.selector.unregister(worker.heartbeat_fd)
+        except KeyError:
+            return
+        os.close(worker.heartbeat_fd)
+        worker.channel.close()
+
+    def retire(self, worker):
+        """Gracefully stop a worker that is no longer routed to"""
+        self.draining.add(worker.pid)
+        self.release(worker)
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def route(self, connection, client_address):
+        """Hand a connection to the worker that owns the client's IP"""
+        slot = zlib.crc32(client_address[0].encode()) % self.count
+        worker = self.slots.get(slot)
+        try:
+            if worker is None:
+                raise OSError('no worker for slot')
+            socket.send_fds(worker.channel, [b'c'], [connection.fileno()])
+        except OSError as e:
+            logger.error(f"Could not dispatch connection from {client_address[0]} to slot {slot}: {e}")
+        finally:
+            connection.close()
+
+    def on_heartbeat(self, worker):
+        try:
+            data = os.read(worker.heartbeat_fd, 4096)
+        except BlockingIOError:
+            return
+        if not data:
+            return
+        worker.last_beat = time.monotonic()
+        if not worker.healthy:
+            worker.healthy = True
+            if self.starting.get(worker.slot) is worker:
+                # Replacement is up, swap it in and drain the old one
+                del self.starting[worker.slot]
+                old = self.slots.get(worker.slot)
+                self.slots[worker.slot] = worker
+                if old:
+                    logger.info(f"Worker {worker.slot} replaced, draining pid {old.pid}")
+                    self.retire(old)
+                self.next_restart()
+
+    def next_restart(self):
+        if self.restart_queue and not self.starting and not self.stopping:
+            slot = self.restart_queue.pop(0)
+            self.starting[slot] = self.spawn(slot)
+
+    def request_restart(self, signum=None, frame=None):
+        self.restart_requested = True
+
+    def rolling_restart(self):
+        logger.info("Rolling restart requested")
+        self.restart_queue = sorted(self.slots)
+        self.next_restart()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def reap(self):
+        """Collect exited workers and replace any that died unexpectedly"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.draining:
+                self.draining.discard(pid)
+                continue
+            for slot, worker in list(self.slots.items()):
+                if worker.pid == pid:
+                    logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+                    self.release(worker)
+                    if time.monotonic() - worker.started < 5:
+                        time.sleep(1)  # crashing on startup, don't spin
+                    self.slots[slot] = self.spawn(slot)
+            for slot, worker in list(self.starting.items()):
+                if worker.pid == pid:
+                    # Died before becoming healthy, the old worker stays in service
+                    logger.warning(f"Replacement for worker {slot} (pid {pid}) failed with status {status}")
+                    self.release(worker)
+                    del self.starting[slot]
+                    self.next_restart()
+
+    def check_health(self):
+        """Kill workers that stopped sending heartbeats, reap() replaces them"""
+        now = time.monotonic()
+        for worker in list(self.slots.values()) + list(self.starting.values()):
+            if now - worker.last_beat > LAUNCHER_CONFIG['heartbeat_timeout']:
+                logger.warning(f"Worker {worker.slot} (pid {worker.pid}) missed heartbeats, killing it")
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                worker.last_beat = now
+
+    def run(self):
+        # No socket survives a restart, so any user still marked online is stale
+        from database import db
+        db.reset_online_users()
+        db.close_connection()
+
+        if self.mode == 'dispatch':
+            self.listener = socket.create_server(self.address, backlog=1024, reuse_port=False)
+            self.listener.setblocking(False)
+            self.selector.register(self.listener, selectors.EVENT_READ, ('accept', None))
+        for slot in range(self.count):
+            self.slots[slot] = self.spawn(slot)
+
+        signal.signal(signal.SIGHUP, self.request_restart)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f"Master {os.getpid()} listening on {self.address[0]}:{self.address[1]} "
+                    f"with {self.count} workers ({self.mode})")
+
+        while not self.stopping:
+            for key, _ in self.selector.select(timeout=1):
+                kind, worker = key.data
+                if kind == 'accept':
+                    try:
+                        connection, client_address = self.listener.accept()
+                    except BlockingIOError:
+                        continue
+                    self.route(connection, client_address)
+                else:
+                    self.on_heartbeat(worker)
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            self.reap()
+            self.check_health()
+
+        logger.info("Stopping workers")
+        if self.listener:
+            self.listener.close()
+        for worker in list(self.slots.values()) + list(self.starting.values()):
+            self.retire(worker)
+        deadline = time.monotonic() + LAUNCHER_CONFIG['grace_period'] + 5
+        while self.draining and time.monotonic() < deadline:
+            self.reap_draining()
+            time.sleep(0.2)
+        for pid in self.draining:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def reap_draining(self):
+        for pid in list(self.draining):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self.draining.discard(pid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=LAUNCHER_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=LAUNCHER_CONFIG['port'])
+    parser.add_argument('--workers', type=int, default=LAUNCHER_CONFIG['workers'])
+    parser.add_argument('--mode', choices=['dispatch', 'reuseport'], default=LAUNCHER_CONFIG['mode'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not hasattr(socket, 'send_fds') or not hasattr(os, 'fork'):
+        sys.exit('launcher.py needs a Unix system and Python 3.9+')
+    if args.mode == 'reuseport' and not hasattr(socket, 'SO_REUSEPORT'):
+        sys.exit('SO_REUSEPORT is not available on this platform, use --mode dispatch')
+    workers = args.workers or os.cpu_count()
+    if workers > 1 and not LAUNCHER_CONFIG['message_queue']:
+        # Without a queue every worker would run a separate chat room
+        sys.exit('More than one worker needs LAUNCHER_CONFIG["message_queue"], e.g. redis://localhost:6379/0')
+    Master(args.host, args.port, workers, args.mode).run()
+
+
+if __name__ == '__main__':
+    main()
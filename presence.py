@@ -0,0 +1,75 @@
+import time
+import random
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceBatcher:
+    """Collects online/offline transitions and applies them in batches.
+
+    Only the latest transition per user is kept, so a user who flaps during a
+    reconnect storm costs one row update per flush instead of one per event.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # user_id -> 'online' | 'offline'
+        self.joined = []
+        self.left = []
+
+    def mark(self, user_id, username, status):
+        with self.lock:
+            self.pending[user_id] = status
+            if status == 'online':
+                self.joined.append(username)
+            else:
+                self.left.append(username)
+
+    def flush(self, db):
+        """Write pending transitions, returns the (joined, left) usernames since the last flush"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            joined, self.joined = self.joined, []
+            left, self.left = self.left, []
+        online = [user_id for user_id, status in pending.items() if status == 'online']
+        offline = [user_id for user_id, status in pending.items() if status == 'offline']
+        if online and not db.set_users_status(online, 'online'):
+            self._requeue(online, 'online')
+        if offline and not db.set_users_status(offline, 'offline'):
+            self._requeue(offline, 'offline')
+        return joined, left
+
+    def _requeue(self, user_ids, status):
+        with self.lock:
+            for user_id in user_ids:
+                self.pending.setdefault(user_id, status)
+
+
+class AdmissionController:
+    """Token bucket that spreads registration bursts over time.
+
+    Each registration takes a token; when the bucket is empty the client is
+    told to retry after a jittered delay instead of piling onto the database.
+    """
+
+    def __init__(self, rate, burst, max_retry_delay=5.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_retry_delay = max_retry_delay
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token, returns 0 on success or the suggested retry delay in seconds"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            wait = (1 - self.tokens) / self.rate
+        return min(self.max_retry_delay, wait + random.uniform(0, wait + 0.5))
@@ -0,0 +1,103 @@
+"""Watermark-based read receipts.
+
+Instead of one socket_message_status row per message per recipient, each
+user has a "last delivered" and "last seen" message id per channel. A
+message is delivered to (seen by) a user when its id is at or below that
+user's watermark. Advancing a watermark only ever moves it forward, and
+advances are buffered in memory and written in one batched upsert.
+
+    python receipts.py migrate    # build watermarks from socket_message_status
+"""
+import sys
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL = 'global'
+
+
+class WatermarkStore:
+    def __init__(self, channel=DEFAULT_CHANNEL):
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.watermarks = {}  # user_id -> {'delivered': id, 'seen': id}
+        self.dirty = set()
+        self.loaded = False
+
+    def _ensure_loaded(self, db):
+        # Watermarks are read on first use so creating the store costs no I/O
+        with self.lock:
+            if not self.loaded:
+                self.loaded = True
+                self._merge(db.get_watermarks(self.channel))
+
+    def _merge(self, stored):
+        # Caller holds the lock; watermarks only move forward
+        for user_id, marks in stored.items():
+            current = self.watermarks.setdefault(user_id, {'delivered': 0, 'seen': 0})
+            current['delivered'] = max(current['delivered'], marks['delivered'])
+            current['seen'] = max(current['seen'], marks['seen'])
+
+    def refresh(self, db):
+        """Pick up advances other processes have written to the database"""
+        stored = db.get_watermarks(self.channel)
+        with self.lock:
+            self.loaded = True
+            self._merge(stored)
+
+    def advance(self, db, user_ids, kind, message_id):
+        """Move the kind ('delivered' or 'seen') watermark of users up to message_id.
+
+        Returns the user ids whose watermark actually moved. Seeing a message
+        implies it was delivered, so 'seen' advances both watermarks.
+        """
+        self._ensure_loaded(db)
+        moved = []
+        with self.lock:
+            for user_id in user_ids:
+                marks = self.watermarks.setdefault(user_id, {'delivered': 0, 'seen': 0})
+                if marks[kind] >= message_id:
+                    continue
+                marks[kind] = message_id
+                if kind == 'seen':
+                    marks['delivered'] = max(marks['delivered'], message_id)
+                self.dirty.add(user_id)
+                moved.append(user_id)
+        return moved
+
+    def statuses(self, db, message_id, author_id):
+        """Derive {user_id: status} for a message from the watermarks"""
+        self._ensure_loaded(db)
+        statuses = {}
+        with self.lock:
+            for user_id, marks in self.watermarks.items():
+                if user_id == author_id:
+                    continue
+                if marks['seen'] >= message_id:
+                    statuses[user_id] = 'seen'
+                elif marks['delivered'] >= message_id:
+                    statuses[user_id] = 'delivered'
+        return statuses
+
+    def flush(self, db):
+        """Write moved watermarks in one statement, returns the number of users written"""
+        with self.lock:
+            user_ids, self.dirty = self.dirty, set()
+            rows = [(user_id, self.watermarks[user_id]['delivered'], self.watermarks[user_id]['seen'])
+                    for user_id in user_ids]
+        if not rows:
+            return 0
+        if not db.save_watermarks(self.channel, rows):
+            with self.lock:
+                self.dirty.update(user_ids)
+            return 0
+        return len(rows)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        sys.exit(__doc__)
+    from database import db
+    migrated = db.migrate_message_status_to_watermarks(DEFAULT_CHANNEL)
+    print(f"Migrated watermarks for {migrated} users")
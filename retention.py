@@ -0,0 +1,29 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def archive_old_messages(db, archive, max_age_days, batch_size=1000):
+    """Move messages older than max_age_days from the database into the archive.
+
+    Messages are appended to the archive before they are deleted, so an
+    interrupted run never loses data: the next run skips ids the archive
+    already holds and only repeats the delete.
+    """
+    total = 0
+    while True:
+        messages = db.get_archivable_messages(max_age_days, batch_size)
+        if not messages:
+            break
+        total += archive.append(messages)
+        last_id = messages[-1]['id']
+        if archive.last_id() < last_id:
+            logger.error(f"Archive is behind the database (archive {archive.last_id()}, batch {last_id}), stopping")
+            break
+        # Only the rows just archived, or held by the archive from an interrupted run
+        if not db.delete_messages([m['id'] for m in messages]):
+            break
+        if len(messages) < batch_size:
+            break
+    logger.info(f"Retention run archived {total} messages older than {max_age_days} days")
+    return total
@@ -0,0 +1,37 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionTracker:
+    """Buffers session activity so last_active is written once per interval.
+
+    Chat handlers call touch() for every message; flush() turns everything
+    touched since the previous flush into a single batched UPDATE.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirty = set()
+
+    def touch(self, socket_id):
+        with self.lock:
+            self.dirty.add(socket_id)
+
+    def discard(self, socket_id):
+        with self.lock:
+            self.dirty.discard(socket_id)
+
+    def flush(self, db):
+        """Write pending activity to the database, returns the number of sessions flushed"""
+        with self.lock:
+            socket_ids, self.dirty = list(self.dirty), set()
+        if not socket_ids:
+            return 0
+        if not db.touch_user_sessions(socket_ids):
+            # Keep the activity for the next flush rather than losing it
+            with self.lock:
+                self.dirty.update(socket_ids)
+            return 0
+        return len(socket_ids)
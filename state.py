@@ -0,0 +1,120 @@
+"""In-memory chat state that survives restarts.
+
+RecentWindow keeps the newest messages in memory so registrations do not
+have to query MySQL. save_snapshot()/load_snapshot() write that state (plus
+presence and the username -> user id map) to a small versioned binary file:
+
+    header   magic b'SBSNAP', format version, created_at, clean flag, section count
+    table    one (name, offset, length, crc32) entry per section
+    sections zlib-compressed JSON
+
+The file is memory-mapped on load and each section checked against its CRC,
+so a torn or foreign file is rejected instead of half-restored.
+"""
+import os
+import json
+import mmap
+import time
+import zlib
+import bisect
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SBSNAP'
+VERSION = 1
+HEADER = struct.Struct('<6sHd?I')
+SECTION = struct.Struct('<16sQII')
+
+
+class RecentWindow:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.messages = []  # sorted by id
+        self.ids = []
+        self.loaded = False
+
+    @property
+    def last_id(self):
+        with self.lock:
+            return self.ids[-1] if self.ids else 0
+
+    def replace(self, messages):
+        with self.lock:
+            self.messages = sorted(messages, key=lambda m: m['id'])[-self.size:]
+            self.ids = [m['id'] for m in self.messages]
+            self.loaded = True
+
+    def extend(self, messages):
+        """Insert messages in id order, ignoring ones the window already has.
+
+        Ids are allocated before the insert commits, so concurrent saves can
+        finish out of order and a message may arrive below last_id.
+        """
+        with self.lock:
+            for message in messages:
+                pos = bisect.bisect_left(self.ids, message['id'])
+                if pos < len(self.ids) and self.ids[pos] == message['id']:
+                    continue
+                if pos == 0 and len(self.ids) >= self.size:
+                    # Older than everything in a full window
+                    continue
+                self.ids.insert(pos, message['id'])
+                self.messages.insert(pos, message)
+            if len(self.ids) > self.size:
+                del self.ids[:-self.size]
+                del self.messages[:-self.size]
+
+    def latest(self, limit):
+        with self.lock:
+            return self.messages[-limit:] if limit else []
+
+
+def save_snapshot(path, sections, clean=False):
+    """Atomically write {name: json-serialisable value} to path"""
+    payloads = [(name, zlib.compress(json.dumps(value, default=str).encode('utf-8'), 6))
+                for name, value in sections.items()]
+    offset = HEADER.size + SECTION.size * len(payloads)
+    table = b''
+    for name, payload in payloads:
+        table += SECTION.pack(name.encode('ascii'), offset, len(payload), zlib.crc32(payload))
+        offset += len(payload)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, time.time(), clean, len(payloads)))
+        f.write(table)
+        for _, payload in payloads:
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    logger.info(f"State snapshot written to {path} ({offset} bytes, clean={clean})")
+
+
+def load_snapshot(path):
+    """Return (sections, created_at, clean) from a snapshot file, or None if unusable"""
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, created_at, clean, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                logger.warning(f"Ignoring snapshot {path}: format {magic!r} v{version}")
+                return None
+            sections = {}
+            for index in range(count):
+                name, offset, length, crc = SECTION.unpack_from(data, HEADER.size + index * SECTION.size)
+                payload = data[offset:offset + length]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    logger.warning(f"Ignoring snapshot {path}: section {name!r} is corrupt")
+                    return None
+                sections[name.rstrip(b'\0').decode('ascii')] = json.loads(zlib.decompress(payload))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error, zlib.error) as e:
+        logger.warning(f"Ignoring snapshot {path}: {e}")
+        return None
+    logger.info(f"State snapshot loaded from {path} (taken {time.time() - created_at:.0f}s ago, clean={clean})")
+    return sections, created_at, clean
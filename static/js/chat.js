@@ -37,6 +37,11 @@ document.addEventListener('DOMContentLoaded', () => {
     let isInConference = false;
     let userIdToUsername = {};
     let activeConferences = new Map(); // Track active conferences by initiator_sid
+    let oldestMessageId = null;
+    let lastMessageId = 0;
+    let payloadQueue = Promise.resolve();
+    let hasMoreHistory = true;
+    let loadingHistory = false;
 
     // Emoji Picker
     const emojiPicker = document.createElement('emoji-picker');
@@ -90,6 +95,10 @@ document.addEventListener('DOMContentLoaded', () => {
             console.log('Connected to server');
             connectionStatus.querySelector('span').textContent = 'Connected';
             connectionIndicator.className = 'connection-indicator';
+            if (username) {
+                // Reconnected after a drop: resume from the last message we have
+                socket.emit('register', registrationPayload());
+            }
         });
 
         socket.on('connect_error', (error) => {
@@ -101,49 +110,84 @@ document.addEventListener('DOMContentLoaded', () => {
 
         socket.on('disconnect', () => {
             console.log('Disconnected from server');
-            connectionStatus.querySelector('span').textContent = 'Disconnected';
+            connectionStatus.querySelector('span').textContent = username ? 'Reconnecting...' : 'Disconnected';
             connectionIndicator.className = 'connection-indicator disconnected';
             if (isInConference) {
                 stopConference();
             }
-            showLoginForm();
+            // Keep the chat on screen, socket.io reconnects and the connect handler resumes
         });
 
         socket.on('connection_response', (data) => {
             console.log(`Connection status: ${data.status}, Socket ID: ${data.socket_id}`);
         });
 
-        socket.on('registration_response', (data) => {
+        onPayload('registration_response', (data) => {
             if (data.status === 'success') {
                 username = data.username;
                 userId = data.user_id;
                 showChatInterface(data.username);
-                if (data.recent_messages && data.recent_messages.length > 0) {
+                if (data.sync === 'delta') {
+                    // Missed messages follow in sync_messages pages
+                } else if (data.recent_messages && data.recent_messages.length > 0) {
+                    clearMessages();
                     emptyState.style.display = 'none';
-                    data.recent_messages.forEach(renderMessage);
+                    oldestMessageId = data.recent_messages[0].id;
+                    data.recent_messages.forEach((message) => renderMessage(message));
                     scrollToBottom();
                 } else {
                     emptyState.style.display = 'flex';
+                    loadOlderMessages();
                 }
-                socket.emit('get_users');
+                updateActiveUsers(data.active_users);
+            } else if (data.status === 'retry') {
+                // Server is smoothing a burst of registrations, try again shortly
+                setTimeout(() => socket && socket.emit('register', registrationPayload()), data.retry_after);
+            } else if (username) {
+                // Resume failed, e.g. the server has not noticed our old socket dropped yet
+                setTimeout(() => socket && socket.emit('register', registrationPayload()), 2000);
             } else {
                 loginError.textContent = data.message;
             }
         });
 
-        socket.on('user_status', (data) => {
+        socket.on('presence_snapshot', (data) => {
             updateActiveUsers(data.active_users);
-            addSystemMessage(`${data.username} has ${data.status === 'online' ? 'joined' : 'left'} the chat`);
+            data.joined.forEach((name) => addSystemMessage(`${name} has joined the chat`));
+            data.left.forEach((name) => addSystemMessage(`${name} has left the chat`));
         });
 
-        socket.on('new_message', (data) => {
+        onPayload('new_message', (data) => {
             console.log('New message:', data);
+            showNewMessages([data]);
+        });
+
+        // Bursts arrive batched, in order
+        onPayload('new_messages', (data) => {
+            showNewMessages(data.messages);
+        });
+
+        onPayload('sync_messages', (data) => {
+            if (!data.messages.length) return;
             emptyState.style.display = 'none';
-            renderMessage(data);
+            data.messages.forEach((message) => renderMessage(message));
             scrollToBottom();
-            if (data.username !== username) {
-                socket.emit('message_seen', { message_id: data.id });
-            }
+        });
+
+        socket.on('sync_complete', (data) => {
+            console.log('Caught up to message', data.last_message_id);
+        });
+
+        onPayload('history_response', (data) => {
+            loadingHistory = false;
+            hasMoreHistory = data.has_more;
+            if (!data.messages.length) return;
+            emptyState.style.display = 'none';
+            const previousHeight = chatMessages.scrollHeight;
+            const firstChild = chatMessages.firstChild;
+            data.messages.forEach((message) => renderMessage(message, firstChild));
+            oldestMessageId = data.messages[0].id;
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
         });
 
         socket.on('typing_status', (data) => {
@@ -155,7 +199,12 @@ document.addEventListener('DOMContentLoaded', () => {
         });
 
         socket.on('message_status', (data) => {
-            updateMessageStatus(data.message_id, data.user_id, data.status);
+            // Statuses are watermarks: everything up to message_id shares the status
+            document.querySelectorAll('.message[data-message-id]').forEach((element) => {
+                if (Number(element.dataset.messageId) <= data.message_id) {
+                    updateMessageStatus(element.dataset.messageId, data.user_id, data.status);
+                }
+            });
         });
 
         socket.on('conference_users', (data) => {
@@ -211,6 +260,35 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Large payloads arrive zlib-compressed as a binary attachment
+    async function unpackPayload(data) {
+        if (!data || !data.compressed) return data;
+        const stream = new Blob([data.data]).stream().pipeThrough(new DecompressionStream('deflate'));
+        return JSON.parse(await new Response(stream).text());
+    }
+
+    function showNewMessages(messages) {
+        emptyState.style.display = 'none';
+        messages.forEach((message) => renderMessage(message));
+        scrollToBottom();
+        // Seen is a watermark, so acknowledging the newest message covers the rest
+        const others = messages.filter((message) => message.username !== username);
+        if (others.length) {
+            socket.emit('message_seen', { message_id: others[others.length - 1].id });
+        }
+    }
+
+    // Register a handler for an event that may be compressed; handlers run
+    // in arrival order even though inflating is asynchronous
+    function onPayload(event, handler) {
+        socket.on(event, (data) => {
+            payloadQueue = payloadQueue
+                .then(() => unpackPayload(data))
+                .then(handler)
+                .catch((error) => console.error(`Error handling ${event}:`, error));
+        });
+    }
+
     // Show chat interface and hide login form
     function showChatInterface(user) {
         username = user;
@@ -221,14 +299,24 @@ document.addEventListener('DOMContentLoaded', () => {
         messageInput.focus();
     }
 
+    // Remove rendered messages, keeping the empty state placeholder
+    function clearMessages() {
+        chatMessages.innerHTML = '';
+        chatMessages.appendChild(emptyState);
+        lastMessageId = 0;
+        oldestMessageId = null;
+        hasMoreHistory = true;
+    }
+
     // Show login form and hide chat interface
     function showLoginForm() {
         chatContainer.style.display = 'none';
         loginContainer.style.display = 'flex';
         usernameInput.value = '';
         loginError.textContent = '';
-        chatMessages.innerHTML = '';
+        clearMessages();
         emptyState.style.display = 'flex';
+        username = '';
         if (socket) {
             socket.disconnect();
             socket = null;
@@ -242,6 +330,17 @@ document.addEventListener('DOMContentLoaded', () => {
         activeConferences.clear();
     }
 
+    function loadOlderMessages() {
+        if (!socket || !(oldestMessageId || lastMessageId) || !hasMoreHistory || loadingHistory) return;
+        loadingHistory = true;
+        // Without a message on screen, page back from the newest one we know of
+        socket.emit('load_history', { before_id: oldestMessageId || lastMessageId + 1, limit: 50 });
+    }
+
+    function registrationPayload() {
+        return { username: username || usernameInput.value.trim(), last_message_id: lastMessageId };
+    }
+
     // Register user with the server
     function registerUser() {
         const inputUsername = usernameInput.value.trim();
@@ -260,7 +359,11 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Render a message
-    function renderMessage(data) {
+    function renderMessage(data, insertBefore = null) {
+        if (document.querySelector(`.message[data-message-id="${data.id}"]`)) {
+            return; // Already shown, e.g. delivered live while a resume was in progress
+        }
+        lastMessageId = Math.max(lastMessageId, data.id);
         console.log('Rendering message:', data);
         const messageElement = document.createElement('div');
         messageElement.classList.add('message');
@@ -371,7 +474,7 @@ document.addEventListener('DOMContentLoaded', () => {
         messageElement.appendChild(bubbleDiv);
         messageElement.appendChild(timestampDiv);
         messageElement.appendChild(statusDiv);
-        chatMessages.appendChild(messageElement);
+        chatMessages.insertBefore(messageElement, insertBefore);
     }
 
     // Update message status display
@@ -547,7 +650,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     type: 'image'
                 });
             };
-            reader.readAsDataURL(file);
+            reader.readAsArrayBuffer(file);
             imageUpload.value = '';
         }
     });
@@ -578,7 +681,7 @@ document.addEventListener('DOMContentLoaded', () => {
                             type: 'voice'
                         });
                     };
-                    reader.readAsDataURL(audioBlob);
+                    reader.readAsArrayBuffer(audioBlob);
                     stream.getTracks().forEach(track => track.stop());
                     audioChunks = [];
                 };
@@ -610,11 +713,12 @@ document.addEventListener('DOMContentLoaded', () => {
         cameraCanvas.width = video.videoWidth;
         cameraCanvas.height = video.videoHeight;
         cameraCanvas.getContext('2d').drawImage(video, 0, 0);
-        const dataUrl = cameraCanvas.toDataURL('image/png');
-        socket.emit('upload_file', {
-            file: dataUrl,
-            type: 'image'
-        });
+        cameraCanvas.toBlob(async (blob) => {
+            socket.emit('upload_file', {
+                file: await blob.arrayBuffer(),
+                type: 'image'
+            });
+        }, 'image/png');
         closeCamera();
     });
 
@@ -1193,6 +1297,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
     logoutBtn.addEventListener('click', showLoginForm);
 
+    chatMessages.addEventListener('scroll', () => {
+        if (chatMessages.scrollTop === 0) loadOlderMessages();
+    });
+
     // Focus on username input
     usernameInput.focus();
 });
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Upload storage.
+
+Files are written under root in hashed shard directories
+(root/3f/a9/<uuid>.png) so no directory grows past a few hundred entries;
+the shard-relative path is what socket_messages.file_path stores and what
+/uploads/<file_path> serves. Files uploaded before sharding stay at the top
+of root and keep working.
+
+Bytes per user and in total are counted in the socket_upload_usage table,
+shared by every process, so a quota check is one conditional UPDATE. scan()
+walks root, corrects the counts from the files that messages reference and
+moves files nothing references to trash, from where they are deleted after
+trash_retention seconds. Until some scan has counted the disk, the first
+save() runs one synchronously, so quotas hold even where no background job
+runs (e.g. under wsgi).
+"""
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = '.upload-'
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class UploadStore:
+    def __init__(self, db, references, root, trash, user_quota, global_quota, shard_levels=2,
+                 orphan_min_age=3600, trash_retention=7 * 86400):
+        # references() returns {file_path: user_id} for every stored message, None on error
+        self.db = db
+        self.references = references
+        self.root = root
+        self.trash = trash
+        self.user_quota = user_quota
+        self.global_quota = global_quota
+        self.shard_levels = shard_levels
+        self.orphan_min_age = orphan_min_age
+        self.trash_retention = trash_retention
+        self.scan_lock = threading.Lock()
+        self.counted = False
+        self.runs = deque(maxlen=10)
+
+    def shard_path(self, filename):
+        digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_levels)]
+        return '/'.join(shards + [filename])
+
+    def _ensure_counted(self):
+        if self.counted:
+            return
+        with self.scan_lock:
+            if self.counted:
+                return
+            usage = self.db.get_upload_usage()
+            if usage is None:
+                return
+            if 0 not in usage:
+                self._scan(cleanup=False)
+            self.counted = True
+
+    def save(self, user_id, content, extension):
+        """Store an upload for user_id, returns its path relative to root.
+
+        Raises QuotaExceeded when the user or the server is out of space.
+        """
+        size = len(content)
+        self._ensure_counted()
+        reserved = self.db.reserve_upload_bytes(user_id, size, self.user_quota, self.global_quota)
+        if reserved == 'user_quota':
+            raise QuotaExceeded('Upload quota exceeded')
+        if reserved == 'global_quota':
+            raise QuotaExceeded('Server storage is full')
+        if reserved is None:
+            raise OSError('Upload usage could not be recorded')
+        file_path = self.shard_path(f"{uuid.uuid4()}.{extension}")
+        target = os.path.join(self.root, *file_path.split('/'))
+        temp = os.path.join(os.path.dirname(target), TEMP_PREFIX + os.path.basename(target))
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(temp, 'wb') as f:
+                f.write(content)
+            os.replace(temp, target)
+        except OSError:
+            self.db.add_upload_usage({user_id: -size, 0: -size})
+            raise
+        return file_path
+
+    def discard(self, user_id, file_path):
+        """Remove an upload that never made it into a message"""
+        path = os.path.join(self.root, *file_path.split('/'))
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self.db.add_upload_usage({user_id: -size, 0: -size})
+
+    def scan(self, cleanup=True, pause=None):
+        """Reconcile the disk with the files messages reference.
+
+        Corrects the usage counts, and with cleanup moves unreferenced
+        files older than orphan_min_age to trash and purges expired trash.
+        pause, if given, is called every few hundred files so a long walk
+        can yield to other work. Only one process should scan at a time.
+        Returns the run's stats, None if the counts could not be read.
+        """
+        with self.scan_lock:
+            stats = self._scan(cleanup, pause)
+            if stats is not None:
+                self.counted = True
+            return stats
+
+    def _scan(self, cleanup=True, pause=None):
+        referenced = self.references()
+        if referenced is None:
+            return None
+        started = time.time()
+        # Uploads and discards while the walk runs change the counts too;
+        # adding the difference to what the walk found keeps them
+        before = self.db.get_upload_usage()
+        if before is None:
+            return None
+        stats = {'started_at': started, 'files': 0, 'bytes': 0, 'missing': 0,
+                 'orphans': 0, 'orphan_bytes': 0, 'purged': 0}
+        usage = defaultdict(int)
+        total = 0
+        found = set()
+        trash = os.path.abspath(self.trash)
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(directory, d)) != trash]
+            for name in files:
+                path = os.path.join(directory, name)
+                file_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                if info.st_mtime >= started:
+                    # Counted when it was saved, after the walk started
+                    continue
+                stats['files'] += 1
+                stats['bytes'] += info.st_size
+                if pause and stats['files'] % 500 == 0:
+                    pause()
+                if file_path in referenced:
+                    found.add(file_path)
+                    usage[referenced[file_path]] += info.st_size
+                    total += info.st_size
+                elif name.startswith(TEMP_PREFIX) or started - info.st_mtime < self.orphan_min_age:
+                    # Still being written, or its message may not be saved yet
+                    total += info.st_size
+                elif cleanup:
+                    self._move_to_trash(path, file_path)
+                    stats['orphans'] += 1
+                    stats['orphan_bytes'] += info.st_size
+                else:
+                    total += info.st_size
+        stats['missing'] = len(referenced.keys() - found)
+        if cleanup:
+            stats['purged'] = self._purge_trash(started)
+        usage[0] = total
+        deltas = {user_id: usage.get(user_id, 0) - before.get(user_id, 0) for user_id in usage.keys() | before.keys()}
+        if not self.db.add_upload_usage({user_id: delta for user_id, delta in deltas.items() if delta or user_id == 0}):
+            return None
+        stats['users'] = len(usage) - 1
+        stats['duration'] = round(time.time() - started, 3)
+        self.runs.append(stats)
+        logger.info(f"Upload scan: {stats['files']} files, {stats['orphans']} orphans moved to trash, "
+                    f"{stats['missing']} missing, {stats['purged']} purged in {stats['duration']}s")
+        return stats
+
+    def _move_to_trash(self, path, file_path):
+        target = os.path.join(self.trash, *file_path.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+        # The move keeps mtime, retention counts from when it was trashed
+        os.utime(target)
+
+    def _purge_trash(self, now):
+        purged = 0
+        for directory, dirs, files in os.walk(self.trash):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if now - os.path.getmtime(path) >= self.trash_retention:
+                        os.remove(path)
+                        purged += 1
+                except OSError:
+                    continue
+        return purged
+
+    def stats(self):
+        counts = self.db.get_upload_usage() or {}
+        return {
+            'total_bytes': counts.get(0, 0),
+            'global_quota': self.global_quota,
+            'user_quota': self.user_quota,
+            'users': sum(1 for user_id, size in counts.items() if user_id and size),
+            'runs': list(self.runs)
+        }
@@ -0,0 +1,166 @@
+"""Bulk export and import of the chat history.
+
+Each table is streamed to <directory>/<table>.jsonl.gz, one JSON object per
+line. Exports read through a server-side cursor and imports write batched
+multi-row INSERTs, so memory use does not grow with the table size.
+Messages already moved to the archive are exported with the live ones, so
+a dump holds the full history.
+
+Every export gets a new dump id in <directory>/manifest.json. Imports record
+a checkpoint per table after every batch, keyed by the dump id and the
+target database, and pick up from it when re-run against the same dump and
+target; a fresh export or another target starts from the first row.
+
+    python transfer.py export backup/
+    python transfer.py import backup/ --batch-size 1000
+"""
+import os
+import sys
+import gzip
+import json
+import re
+import uuid
+import argparse
+import itertools
+
+# Parents before children so foreign keys hold during import
+TABLES = [
+    ('socket_users', 'id'),
+    ('socket_messages', 'id'),
+    ('socket_message_status', 'id'),
+    ('socket_read_watermarks', 'user_id, channel'),
+]
+
+
+def table_path(directory, table):
+    return os.path.join(directory, f"{table}.jsonl.gz")
+
+
+def manifest_path(directory):
+    return os.path.join(directory, 'manifest.json')
+
+
+def read_dump_id(directory):
+    """Dump id of a finished export, None if the directory has none"""
+    try:
+        with open(manifest_path(directory)) as f:
+            return json.load(f)['dump_id']
+    except FileNotFoundError:
+        return None
+
+
+def target_name(db_config):
+    target = f"{db_config['host']}-{db_config['port']}-{db_config['database']}"
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', target)
+
+
+def checkpoint_path(directory, table, target):
+    return os.path.join(directory, f"{table}.{target}.checkpoint")
+
+
+def read_checkpoint(directory, table, target, dump_id):
+    """Rows of table already imported into target from this dump"""
+    try:
+        with open(checkpoint_path(directory, table, target)) as f:
+            checkpoint_dump, count = f.read().split()
+    except (FileNotFoundError, ValueError):
+        return 0
+    return int(count) if checkpoint_dump == dump_id else 0
+
+
+def write_checkpoint(directory, table, target, dump_id, count):
+    # Written to a temporary file and renamed so a crash never leaves half a number
+    path = checkpoint_path(directory, table, target)
+    with open(path + '.tmp', 'w') as f:
+        f.write(f"{dump_id} {count}")
+    os.replace(path + '.tmp', path)
+
+
+def archived_rows(archive, table):
+    """Rows of table that live in the archive instead of the database"""
+    if archive is None:
+        return
+    for message in archive.iter_messages():
+        if table == 'socket_messages':
+            yield {column: message.get(column) for column in
+                   ('id', 'user_id', 'message', 'message_type', 'file_path', 'created_at')}
+        elif table == 'socket_message_status':
+            # The archive does not keep status row ids; the target assigns new
+            # ones and its unique (message_id, user_id) key skips repeats
+            for user_id, status in message.get('statuses', {}).items():
+                yield {'message_id': message['id'], 'user_id': int(user_id),
+                       'status': status, 'updated_at': message['created_at']}
+
+
+def export_tables(db, directory, archive=None):
+    os.makedirs(directory, exist_ok=True)
+    # Checkpoints of an earlier dump in this directory do not apply to the new
+    # one, and without a manifest a half-written export cannot be mistaken for it
+    for name in os.listdir(directory):
+        if name.endswith('.checkpoint') or name == 'manifest.json':
+            os.remove(os.path.join(directory, name))
+    counts = {}
+    for table, order_by in TABLES:
+        count = archived = 0
+        # Live rows first, so archived rows without an id cannot take an id a
+        # live row still needs
+        with gzip.open(table_path(directory, table), 'wt', encoding='utf-8') as f:
+            for row in db.stream_rows(table, order_by):
+                f.write(json.dumps(row, default=str, ensure_ascii=False) + '\n')
+                count += 1
+            for row in archived_rows(archive, table):
+                f.write(json.dumps(row, default=str, ensure_ascii=False) + '\n')
+                archived += 1
+        counts[table] = count + archived
+        print(f"Exported {count} rows from {table}" + (f" and {archived} from the archive" if archived else ""))
+    with open(manifest_path(directory), 'w') as f:
+        json.dump({'dump_id': uuid.uuid4().hex, 'rows': counts}, f)
+
+
+def import_tables(db, directory, batch_size, target):
+    dump_id = read_dump_id(directory)
+    if dump_id is None:
+        sys.exit(f"{manifest_path(directory)} not found, {directory} is not a finished export")
+    for table, _ in TABLES:
+        path = table_path(directory, table)
+        if not os.path.exists(path):
+            print(f"Skipping {table}: {path} not found")
+            continue
+        done = read_checkpoint(directory, table, target, dump_id)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = itertools.islice(f, done, None)
+            while True:
+                batch = [json.loads(line) for line in itertools.islice(lines, batch_size)]
+                if not batch:
+                    break
+                # Archived rows may carry fewer columns than live ones
+                for columns, rows in itertools.groupby(batch, key=lambda row: tuple(row.keys())):
+                    if not db.insert_rows(table, list(columns), list(rows)):
+                        sys.exit(f"Import of {table} failed after {done} rows, re-run to resume")
+                done += len(batch)
+                write_checkpoint(directory, table, target, dump_id, done)
+        print(f"Imported {table} up to row {done}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('directory')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    from config import DB_CONFIG, ARCHIVE_CONFIG
+    from database import db
+    if args.command == 'export':
+        archive = None
+        if os.path.isdir(ARCHIVE_CONFIG['directory']):
+            from archive import MessageArchive
+            archive = MessageArchive(ARCHIVE_CONFIG['directory'], ARCHIVE_CONFIG['block_size'],
+                                     ARCHIVE_CONFIG['segment_max_messages'])
+        export_tables(db, args.directory, archive)
+    else:
+        import_tables(db, args.directory, args.batch_size, target_name(DB_CONFIG))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import json
+import zlib
+from config import TRANSPORT_PROFILES
+
+
+def socketio_options(profile_name):
+    """SocketIO keyword arguments for a transport profile"""
+    options = dict(TRANSPORT_PROFILES[profile_name])
+    options.pop('payload_compression_threshold')
+    return options
+
+
+def pack_payload(payload, threshold):
+    """Compress an event payload whose JSON is larger than threshold bytes.
+
+    Small payloads are returned unchanged. Large ones become
+    {'compressed': True, 'data': <zlib bytes>}, which Socket.IO sends as a
+    binary attachment and the client inflates with DecompressionStream.
+    """
+    encoded = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    if len(encoded) <= threshold:
+        return payload
+    return {'compressed': True, 'data': zlib.compress(encoded, 6)}
@@ -0,0 +1,420 @@
+"""Workload capture and replay.
+
+A workload is a JSON lines file of timestamped events, t being seconds since
+the start of the workload:
+
+    {"t": 0.52, "kind": "socket", "client": "k3JH...", "event": "chat_message", "data": {...}, "message_id": 812}
+    {"t": 0.53, "kind": "db", "op": "save_message", "args": {"user_id": 4, "message_type": "text"}, "message_id": 812}
+
+Socket events are what a client emitted to the server, captured live by
+app.py when WORKLOAD_CONFIG['capture_path'] is set. Database operations are
+rebuilt from database.log, which already logs every call with a timestamp.
+Binary payloads are stored as {"$bytes": size} and regenerated on replay, and
+message ids are remapped to the ids the replay target assigns.
+
+    python workload.py parse database.log workload.jsonl [--socket] [--max-gap 60]
+    python workload.py replay workload.jsonl --target db [--speed 10]
+    python workload.py replay workload.jsonl --target server --url http://127.0.0.1:8000
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+import statistics
+from collections import defaultdict, deque
+
+LOG_TIMESTAMP = '%Y-%m-%d %H:%M:%S,%f'
+LOG_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - INFO - (.*)$')
+
+# database.log message -> (Database method, argument names, argument types)
+LOG_OPERATIONS = [
+    (re.compile(r'^New user (\S+) created with ID (\d+)$'), 'save_user', ('username', 'user_id'), (str, int)),
+    (re.compile(r'^User (\S+) status updated to online$'), 'save_user', ('username',), (str,)),
+    (re.compile(r'^User ID (\d+) status updated to (\w+)$'), 'set_user_status', ('user_id', 'status'), (int, str)),
+    (re.compile(r'^Message saved: ID (\d+), Type (\w+), User ID (\d+)$'), 'save_message',
+     ('message_id', 'message_type', 'user_id'), (int, str, int)),
+    (re.compile(r'^Retrieved \d+ recent messages$'), 'get_recent_messages', (), ()),
+    (re.compile(r'^Retrieved (\d+) active users$'), 'get_active_users', (), ()),
+    (re.compile(r'^Session saved for user ID (\d+), Socket ID (\S+)$'), 'save_user_session', ('user_id', 'socket_id'), (int, str)),
+    (re.compile(r'^Session updated for Socket ID (\S+)$'), 'update_user_session', ('socket_id',), (str,)),
+    (re.compile(r'^Session closed for Socket ID (\S+)$'), 'close_user_session', ('socket_id',), (str,)),
+    (re.compile(r'^Retrieved user for Socket ID (\S+): '), 'get_user_by_socket_id', ('socket_id',), (str,)),
+    (re.compile(r'^Message (\d+) status updated to (\w+) for user (\d+)$'), 'update_message_status',
+     ('message_id', 'status', 'user_id'), (int, str, int)),
+    (re.compile(r'^Retrieved status for message (\d+)$'), 'get_message_status', ('message_id',), (int,)),
+    (re.compile(r'^Retrieved \d+ messages before ID (\d+)$'), 'get_messages_before', ('before_id',), (int,)),
+    (re.compile(r'^Retrieved \d+ messages after ID (\d+)$'), 'get_messages_after', ('after_id',), (int,)),
+]
+
+# Events worth replaying; video signalling targets peer socket ids that do not
+# exist on replay, and connect is implied by a client's first event
+CAPTURED_EVENTS = {'register', 'disconnect', 'chat_message', 'upload_file', 'typing',
+                   'get_users', 'message_seen', 'load_history'}
+# Size of the placeholder payload for uploads rebuilt from database.log
+LOG_UPLOAD_BYTES = 16 * 1024
+
+
+def encode_data(value):
+    """Replace binary payloads with their size so captures stay small and JSON-safe"""
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': len(value)}
+    if isinstance(value, str) and value.startswith('data:') and ';base64,' in value[:64]:
+        return {'$bytes': len(value) * 3 // 4}
+    if isinstance(value, dict):
+        return {key: encode_data(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_data(item) for item in value]
+    return value
+
+
+def decode_data(value):
+    if isinstance(value, dict):
+        if set(value) == {'$bytes'}:
+            return os.urandom(value['$bytes'])
+        return {key: decode_data(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_data(item) for item in value]
+    return value
+
+
+class WorkloadRecorder:
+    """Append Socket.IO events received by the server to a workload file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = None
+        self.file = None
+
+    def record(self, client, event, data=None, **fields):
+        if event not in CAPTURED_EVENTS:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if self.file is None:
+                # Opened on first event, after the launcher has forked this worker
+                path = self.path.format(pid=os.getpid())
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                self.file = open(path, 'a', buffering=1)
+                self.started = now
+            line = {'t': round(now - self.started, 4), 'kind': 'socket', 'client': client,
+                    'event': event, 'data': encode_data(data)}
+            line.update(fields)
+            self.file.write(json.dumps(line, separators=(',', ':'), default=str) + '\n')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def parse_database_log(lines, max_gap=None):
+    """Rebuild database operations from database.log lines.
+
+    Idle gaps longer than max_gap seconds (between runs of the app, say) are
+    shortened to max_gap so the workload keeps its bursts but not its downtime.
+    """
+    events = []
+    started = previous = None
+    offset = 0.0
+    for line in lines:
+        match = LOG_LINE.match(line.rstrip('\n'))
+        if not match:
+            continue
+        for pattern, op, names, types in LOG_OPERATIONS:
+            found = pattern.match(match.group(2))
+            if found:
+                break
+        else:
+            continue
+        timestamp = datetime.datetime.strptime(match.group(1), LOG_TIMESTAMP).timestamp()
+        if started is None:
+            started = previous = timestamp
+        if max_gap is not None and timestamp - previous > max_gap:
+            offset += timestamp - previous - max_gap
+        previous = timestamp
+        args = {name: kind(value) for name, kind, value in zip(names, types, found.groups())}
+        event = {'t': round(timestamp - started - offset, 4), 'kind': 'db', 'op': op, 'args': args}
+        if op == 'save_message':
+            event['message_id'] = args.pop('message_id')
+        events.append(event)
+    link_user_ids(events)
+    return events
+
+
+def link_user_ids(events):
+    """Attach the user id to save_user calls from the session saved right after them"""
+    pending = None
+    for event in events:
+        if event['op'] == 'save_user':
+            pending = event if 'user_id' not in event['args'] else None
+        elif event['op'] == 'save_user_session' and pending is not None:
+            pending['args']['user_id'] = event['args']['user_id']
+            pending = None
+
+
+def socket_events_from_db(events):
+    """Translate database operations into the client events that caused them"""
+    sockets = {}  # user id -> client key of its current connection
+    names = {}    # lower-cased username -> client key registered with it
+    result = []
+    for event in events:
+        op, args, t = event['op'], event['args'], event['t']
+        if op == 'save_user':
+            user_id = args.get('user_id')
+            username = args['username']
+            client = f"{username}-{len(result)}"
+            previous = names.get(username.lower())
+            if previous is not None:
+                # The server lets one connection hold a name, so the old one
+                # must be gone before the new one registers
+                result.append({'t': t, 'kind': 'socket', 'client': previous, 'event': 'disconnect', 'data': None})
+                sockets = {key: value for key, value in sockets.items() if value != previous}
+            names[username.lower()] = client
+            if user_id is not None:
+                sockets[user_id] = client
+            result.append({'t': t, 'kind': 'socket', 'client': client, 'event': 'register',
+                           'data': {'username': username}})
+        elif op == 'set_user_status' and args['status'] == 'offline' and args['user_id'] in sockets:
+            client = sockets.pop(args['user_id'])
+            names = {key: value for key, value in names.items() if value != client}
+            result.append({'t': t, 'kind': 'socket', 'client': client, 'event': 'disconnect', 'data': None})
+        elif op == 'save_message' and args['user_id'] in sockets:
+            client = sockets[args['user_id']]
+            if args['message_type'] == 'text':
+                data = {'message': f"Replayed message {event['message_id']}", 'type': 'text'}
+                name = 'chat_message'
+            else:
+                data = {'file': {'$bytes': LOG_UPLOAD_BYTES}, 'type': args['message_type']}
+                name = 'upload_file'
+            result.append({'t': t, 'kind': 'socket', 'client': client, 'event': name,
+                           'data': data, 'message_id': event['message_id']})
+        elif op == 'update_message_status' and args['status'] == 'seen' and args['user_id'] in sockets:
+            result.append({'t': t, 'kind': 'socket', 'client': sockets[args['user_id']],
+                           'event': 'message_seen', 'data': {'message_id': args['message_id']}})
+        elif op == 'get_messages_before':
+            client = next(reversed(sockets.values()), None)
+            if client:
+                result.append({'t': t, 'kind': 'socket', 'client': client, 'event': 'load_history',
+                               'data': {'before_id': args['before_id'], 'limit': 50}})
+    return result
+
+
+def load_workload(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_workload(path, events):
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+
+class ReplayStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.max_lag = 0.0
+
+    def report(self, elapsed, duration):
+        total = sum(len(samples) for samples in self.latencies.values())
+        print(f"Replayed {total} events in {elapsed:.1f}s (workload spans {duration:.1f}s), "
+              f"max schedule lag {self.max_lag * 1000:.1f} ms")
+        print(f"{'operation':<24} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for name in sorted(self.latencies.keys() | self.errors.keys()):
+            ordered = sorted(self.latencies.get(name, []))
+            if not ordered:
+                print(f"{name:<24} {0:>7} {self.errors[name]:>7}")
+                continue
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            print(f"{name:<24} {len(ordered):>7} {self.errors[name]:>7} {statistics.median(ordered) * 1000:>9.2f} "
+                  f"{p95 * 1000:>9.2f} {ordered[-1] * 1000:>9.2f}")
+
+
+def paced(events, speed, stats):
+    """Yield events at their recorded offsets divided by speed (0 = as fast as possible)"""
+    started = time.monotonic()
+    for event in events:
+        if speed:
+            due = started + event['t'] / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                stats.max_lag = max(stats.max_lag, -delay)
+        yield event
+
+
+def replay_database(events, db, speed=1.0):
+    """Call the Database methods recorded in events, returns ReplayStats"""
+    stats = ReplayStats()
+    user_ids = {}     # recorded user id -> replayed user id
+    message_ids = {}  # recorded message id -> replayed message id
+    for event in paced([e for e in events if e['kind'] == 'db'], speed, stats):
+        op, args = event['op'], dict(event['args'])
+        if 'user_id' in args and op != 'save_user':
+            if args['user_id'] not in user_ids:
+                user_ids[args['user_id']] = db.save_user(f"replay{args['user_id']}", set_online=False)
+            args['user_id'] = user_ids[args['user_id']]
+        for key in ('message_id', 'before_id', 'after_id'):
+            if key in args:
+                args[key] = message_ids.get(args[key], args[key])
+        if op == 'save_user':
+            recorded_id = args.pop('user_id', None)
+        elif op == 'save_message':
+            args['message'] = f"Replayed message {event['message_id']}"
+        start = time.perf_counter()
+        result = getattr(db, op)(**args)
+        stats.latencies[op].append(time.perf_counter() - start)
+        # Writes report failure with None or False, lookups may legitimately find nothing
+        if result is False or (result is None and op.startswith('save_')):
+            stats.errors[op] += 1
+        elif op == 'save_user' and recorded_id is not None:
+            user_ids[recorded_id] = result
+        elif op == 'save_message':
+            message_ids[event['message_id']] = result['id']
+    return stats
+
+
+class ReplayClient:
+    """One replayed connection to a running server"""
+
+    def __init__(self, socketio, url, transports, stats, message_ids):
+        self.client = socketio.Client()
+        self.url = url
+        self.transports = transports
+        self.stats = stats
+        self.message_ids = message_ids
+        self.username = None
+        self.pending = {}  # event name -> deque of send times
+        self.sent_ids = deque()  # recorded ids of our messages awaiting new_message
+        self.client.on('registration_response', self.on_response('register'))
+        self.client.on('history_response', self.on_response('load_history'))
+        self.client.on('file_response', self.on_response('upload_file'))
+        self.client.on('new_message', self.on_new_message)
+        self.client.on('new_messages', lambda data: [self.on_new_message(m) for m in data['messages']])
+
+    def on_response(self, event):
+        def handler(data):
+            if isinstance(data, dict) and data.get('status', 'success') != 'success':
+                # e.g. a taken username, after which this client's messages are dropped
+                self.stats.errors[event] += 1
+            if self.pending.get(event):
+                self.stats.latencies[event].append(time.perf_counter() - self.pending[event].popleft())
+        return handler
+
+    def on_new_message(self, data):
+        if data.get('username') != self.username or not self.sent_ids:
+            return
+        sent_at, recorded_id = self.sent_ids.popleft()
+        self.stats.latencies['new_message'].append(time.perf_counter() - sent_at)
+        if recorded_id is not None:
+            self.message_ids[recorded_id] = data['id']
+
+    def emit(self, event, data, recorded_id=None):
+        if event == 'disconnect':
+            self.client.disconnect()
+            return
+        if not self.client.connected:
+            self.client.connect(self.url, transports=self.transports)
+        if event == 'register':
+            self.username = data.get('username')
+            if data.get('last_message_id'):
+                # A recorded id means nothing to this server unless the message
+                # was replayed here; without a mapping register for a snapshot
+                data = dict(data)
+                last_message_id = self.message_ids.get(data.pop('last_message_id'))
+                if last_message_id is not None:
+                    data['last_message_id'] = last_message_id
+        for key in ('message_id', 'before_id'):
+            if isinstance(data, dict) and key in data:
+                data[key] = self.message_ids.get(data[key], data[key])
+        now = time.perf_counter()
+        if event in ('chat_message', 'upload_file'):
+            self.sent_ids.append((now, recorded_id))
+        elif event in ('register', 'load_history'):
+            self.pending.setdefault(event, deque()).append(now)
+        self.client.emit(event, data)
+        self.stats.latencies[f"emit {event}"].append(time.perf_counter() - now)
+
+
+def replay_server(events, url, speed=1.0, transports=('websocket',)):
+    """Emit the socket events of a workload against a running server, returns ReplayStats"""
+    try:
+        import socketio
+    except ImportError:
+        sys.exit('Server replay needs python-socketio: pip install "python-socketio[client]"')
+    socket_events = [e for e in events if e['kind'] == 'socket']
+    if not socket_events:
+        socket_events = socket_events_from_db(events)
+    stats = ReplayStats()
+    clients = {}
+    message_ids = {}
+    try:
+        for event in paced(socket_events, speed, stats):
+            client = clients.get(event['client'])
+            if client is None:
+                if event['event'] == 'disconnect':
+                    continue
+                client = clients[event['client']] = ReplayClient(socketio, url, list(transports), stats, message_ids)
+            try:
+                client.emit(event['event'], decode_data(event['data']), event.get('message_id'))
+            except Exception as e:
+                stats.errors[f"emit {event['event']}"] += 1
+                print(f"Replay error on {event['event']}: {e}")
+        # Give the server a moment to answer the last events
+        time.sleep(1)
+    finally:
+        for client in clients.values():
+            if client.client.connected:
+                client.client.disconnect()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capture and replay chat workloads')
+    commands = parser.add_subparsers(dest='command', required=True)
+    parse = commands.add_parser('parse', help='rebuild a workload from database.log')
+    parse.add_argument('log')
+    parse.add_argument('output')
+    parse.add_argument('--socket', action='store_true', help='write client events instead of database operations')
+    parse.add_argument('--max-gap', type=float, default=60, help='shorten idle gaps to this many seconds')
+    replay = commands.add_parser('replay', help='replay a workload')
+    replay.add_argument('workload')
+    replay.add_argument('--target', choices=['db', 'server'], required=True)
+    replay.add_argument('--url', default='http://127.0.0.1:8000')
+    replay.add_argument('--speed', type=float, default=1, help='time scale, 0 replays as fast as possible')
+    replay.add_argument('--transports', default='websocket')
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        with open(args.log, errors='replace') as f:
+            events = parse_database_log(f, args.max_gap)
+        if args.socket:
+            events = socket_events_from_db(events)
+        save_workload(args.output, events)
+        span = events[-1]['t'] if events else 0
+        print(f"Wrote {len(events)} events spanning {span:.1f}s to {args.output}")
+        return
+
+    events = load_workload(args.workload)
+    duration = events[-1]['t'] if events else 0
+    started = time.monotonic()
+    if args.target == 'db':
+        if not any(e['kind'] == 'db' for e in events):
+            sys.exit('Workload has no database operations, replay it with --target server')
+        from database import db
+        stats = replay_database(events, db, args.speed)
+    else:
+        stats = replay_server(events, args.url, args.speed, args.transports.split(','))
+    stats.report(time.monotonic() - started, duration)
+
+
+if __name__ == '__main__':
+    main()